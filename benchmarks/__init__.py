@@ -0,0 +1,5 @@
+"""
+Benchmarks for the hot paths of ezmsg-ssvep on synthetic SSVEP data.
+
+    python -m benchmarks --output results.json
+"""
@@ -0,0 +1,92 @@
+import sys
+import json
+import time
+import typing
+import platform
+
+from pathlib import Path
+from dataclasses import asdict
+
+import numpy as np
+import scipy
+
+from ezmsg.ssvep import __version__
+
+from .synthetic import SyntheticConfig
+from .timing import BenchmarkResult
+from .components import run_components, stats_settings
+from .endtoend import bench_end_to_end
+
+
+def environment() -> typing.Dict[str, typing.Any]:
+    return dict(
+        ezmsg_ssvep = __version__,
+        python = sys.version.split()[0],
+        numpy = np.__version__,
+        scipy = scipy.__version__,
+        platform = platform.platform(),
+        processor = platform.processor(),
+        timestamp = time.time(),
+    )
+
+
+def write_results(path: typing.Optional[Path], results: typing.List[BenchmarkResult], args: typing.Dict[str, typing.Any]) -> None:
+    report = json.dumps(dict(
+        environment = environment(),
+        args = args,
+        results = [asdict(result) for result in results]
+    ), indent = 2, default = str)
+    if path is None:
+        print(report)
+    else:
+        path.write_text(report)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description = 'Time ezmsg-ssvep components and SpectralStats end-to-end on synthetic SSVEP data'
+    )
+
+    parser.add_argument('--output', type = Path, default = None, help = 'JSON results file (default: stdout)')
+    parser.add_argument('--fs', type = float, default = 250.0, help = 'Sample rate (Hz)')
+    parser.add_argument('--channels', type = int, default = 8, help = 'Channel count')
+    parser.add_argument('--freqs', type = float, nargs = '+', default = [7.0, 9.0, 13.0], help = 'SSVEP target frequencies (Hz)')
+    parser.add_argument('--snr', type = float, default = -10.0, help = 'SSVEP to broadband noise power per channel (dB)')
+    parser.add_argument('--iterations', type = int, default = 100, help = 'Timed calls per component')
+    parser.add_argument('--trials', type = int, default = 32, help = 'Stored trials for update_stats and trials run end-to-end')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--skip-components', action = 'store_true', help = 'Only run end-to-end')
+    parser.add_argument('--skip-end-to-end', action = 'store_true', help = 'Only time components')
+
+    args = parser.parse_args()
+
+    config = SyntheticConfig(
+        fs = args.fs,
+        n_channels = args.channels,
+        freqs = tuple(args.freqs),
+        snr_db = args.snr,
+        seed = args.seed
+    )
+
+    results: typing.List[BenchmarkResult] = []
+    if not args.skip_components:
+        results.extend(run_components(config, n_iter = args.iterations, n_trials = args.trials))
+
+    if not args.skip_end_to_end:
+        for name, stats in (
+            ('end_to_end', stats_settings(config)),
+            ('end_to_end_fused', stats_settings(config, fused_spectrum = True)),
+        ):
+            results.append(bench_end_to_end(config, args.trials, stats, name = name))
+
+    for result in results:
+        print(
+            f'{result.name:32s} {result.throughput:10.1f}/s  '
+            f'p50 {result.p50_ms:8.3f} ms  p99 {result.p99_ms:8.3f} ms  '
+            f'peak {(result.peak_memory or 0) / 2 ** 20:7.2f} MiB',
+            file = sys.stderr
+        )
+
+    write_results(args.output, results, {name: str(value) for name, value in vars(args).items()})
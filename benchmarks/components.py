@@ -0,0 +1,127 @@
+import typing
+import asyncio
+import itertools
+
+from dataclasses import asdict
+
+import ezmsg.core as ez
+
+from ezmsg.ssvep.spectralstats import SpectralStatsCalc, SpectralStatsSettings, StatsTest
+from ezmsg.ssvep.spectralccaextractor import SpectralCcaExtractor, SpectralCcaSettings, CcaDecoder
+from ezmsg.ssvep.stimulus import RadialCheckerboard
+
+from .synthetic import SyntheticConfig, synthetic_samples, synthetic_stream
+from .timing import BenchmarkResult, measure, measure_async
+
+UnitType = typing.TypeVar('UnitType', bound = ez.Unit)
+
+
+def make_unit(cls: typing.Type[UnitType], settings: ez.Settings) -> UnitType:
+    """ Stand-alone unit whose coroutines can be driven directly, outside ez.run """
+    unit = cls(settings)
+    unit._instantiate_state()
+    unit.initialize()
+    return unit
+
+
+def stats_settings(config: SyntheticConfig, **kwargs: typing.Any) -> SpectralStatsSettings:
+    return SpectralStatsSettings(
+        time_axis = 'time',
+        integration_time = min(config.pre, config.post),
+        freq_range = slice(1.0, 40.0),
+        **kwargs
+    )
+
+
+async def _drain(agen: typing.AsyncGenerator) -> None:
+    async for _ in agen:
+        pass
+
+
+async def bench_split_sample(config: SyntheticConfig, n_iter: int, fused: bool) -> BenchmarkResult:
+    """ One trial through split_sample; fused also computes both spectra and stores the pair """
+    samples = synthetic_samples(16, config)
+    unit = make_unit(SpectralStatsCalc, stats_settings(config, fused_spectrum = fused, max_trials = 64))
+    cycle = itertools.cycle(samples)
+    return await measure_async(
+        'split_sample' + ('_fused' if fused else ''),
+        lambda: _drain(unit.split_sample(next(cycle))),
+        n_iter,
+        params = dict(fused_spectrum = fused)
+    )
+
+
+async def bench_update_stats(config: SyntheticConfig, n_iter: int, n_trials: int, stats_test: StatsTest) -> BenchmarkResult:
+    """ One refresh of the statistics over n_trials stored trials """
+    unit = make_unit(SpectralStatsCalc, stats_settings(config, fused_spectrum = True, stats_test = stats_test))
+    for sample in synthetic_samples(n_trials, config):
+        await _drain(unit.split_sample(sample))
+
+    stats = unit.update_stats()
+
+    async def refresh() -> None:
+        unit.STATE.refresh_stats.set()
+        await stats.__anext__()
+
+    result = await measure_async(
+        f'update_stats_{stats_test.name.lower()}',
+        refresh,
+        n_iter,
+        params = dict(n_trials = n_trials, stats_test = stats_test.name)
+    )
+    await stats.aclose()
+    return result
+
+
+async def bench_extract(config: SyntheticConfig, n_iter: int, decoder: CcaDecoder, window_dur: float = 1.0) -> BenchmarkResult:
+    """ One window (or, for STREAMING, one 40 ms block) through SpectralCcaExtractor.extract """
+    settings = SpectralCcaSettings(freqoi = list(config.freqs), decoder = decoder, window_dur = window_dur)
+    if decoder == CcaDecoder.STREAMING:
+        messages = synthetic_stream(max(4.0 * window_dur, 2.0), 0.04, config)
+    else:
+        messages = synthetic_stream(8.0 * window_dur, window_dur, config)
+    unit = make_unit(SpectralCcaExtractor, settings)
+    cycle = itertools.cycle(messages)
+    result = await measure_async(
+        f'extract_{decoder.name.lower()}',
+        lambda: _drain(unit.extract(next(cycle))),
+        n_iter,
+        params = dict(decoder = decoder.name, window_dur = window_dur)
+    )
+    unit.shutdown()
+    return result
+
+
+def bench_gif_stimulus(n_iter: int, size: int = 600, duration: float = 0.08) -> typing.List[BenchmarkResult]:
+    """ Designing the checkerboard frames, and encoding them into a GIF, bypassing every cache """
+    stim = RadialCheckerboard(duration = duration, size = size)
+    params = dict(size = size, duration = duration)
+    return [
+        measure('gif_design', stim.images, n_iter, params = params),
+        measure('gif_encode', stim.encode, n_iter, params = params),
+    ]
+
+
+def run_components(
+    config: SyntheticConfig,
+    n_iter: int = 100,
+    n_trials: int = 32
+) -> typing.List[BenchmarkResult]:
+    async def run() -> typing.List[BenchmarkResult]:
+        results = [
+            await bench_split_sample(config, n_iter, fused = False),
+            await bench_split_sample(config, n_iter, fused = True),
+        ]
+        for stats_test in StatsTest:
+            # Permutation refreshes are much slower; fewer calls keep the suite short
+            iters = n_iter if stats_test == StatsTest.MANN_WHITNEY else max(n_iter // 10, 5)
+            results.append(await bench_update_stats(config, iters, n_trials, stats_test))
+        for decoder in (CcaDecoder.SKLEARN, CcaDecoder.CLOSED_FORM, CcaDecoder.FBCCA, CcaDecoder.STREAMING):
+            results.append(await bench_extract(config, n_iter, decoder))
+        return results
+
+    results = asyncio.run(run())
+    results.extend(bench_gif_stimulus(max(n_iter // 20, 3)))
+    for result in results:
+        result.params.update(config = asdict(config))
+    return results
@@ -0,0 +1,136 @@
+import time
+import typing
+import asyncio
+import tracemalloc
+
+from dataclasses import asdict
+
+import ezmsg.core as ez
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage
+
+from ezmsg.ssvep.spectralstats import SpectralStats, SpectralStatsSettings
+
+from .synthetic import SyntheticConfig, synthetic_samples
+from .timing import BenchmarkResult, summarize
+
+
+class TrialSourceSettings(ez.Settings):
+    config: SyntheticConfig
+    n_trials: int
+    timeout: float = 10.0 # sec to wait for statistics before giving up on the run
+
+
+class TrialSourceState(ez.State):
+    ack: asyncio.Event
+    latencies: typing.List[float]
+
+
+class TrialSource(ez.Unit):
+    """
+    Publishes synthetic trials one at a time, each only after the statistics
+    for the previous one came back, and records every round trip
+    """
+    SETTINGS: TrialSourceSettings
+    STATE: TrialSourceState
+
+    INPUT_ACK = ez.InputStream(bool)
+    OUTPUT_SAMPLE = ez.OutputStream(SampleMessage)
+
+    def initialize(self) -> None:
+        self.STATE.ack = asyncio.Event()
+        self.STATE.latencies = []
+
+    @ez.subscriber(INPUT_ACK)
+    async def on_ack(self, msg: bool) -> None:
+        self.STATE.ack.set()
+
+    @ez.publisher(OUTPUT_SAMPLE)
+    async def publish(self) -> typing.AsyncGenerator:
+        samples = synthetic_samples(self.SETTINGS.n_trials, self.SETTINGS.config)
+        await asyncio.sleep(0.5) # let the graph connect
+        for sample in samples:
+            self.STATE.ack.clear()
+            start = time.perf_counter()
+            yield self.OUTPUT_SAMPLE, sample
+            try:
+                await asyncio.wait_for(self.STATE.ack.wait(), self.SETTINGS.timeout)
+            except asyncio.TimeoutError:
+                ez.logger.warning(f'No statistics after {self.SETTINGS.timeout} sec; ending the run early')
+                break
+            self.STATE.latencies.append(time.perf_counter() - start)
+        raise ez.NormalTermination
+
+
+class StatsAck(ez.Unit):
+    INPUT_STATS = ez.InputStream(typing.Optional[AxisArray])
+    OUTPUT_ACK = ez.OutputStream(bool)
+
+    @ez.subscriber(INPUT_STATS)
+    @ez.publisher(OUTPUT_ACK)
+    async def on_stats(self, msg: typing.Optional[AxisArray]) -> typing.AsyncGenerator:
+        yield self.OUTPUT_ACK, True
+
+
+class EndToEndSettings(ez.Settings):
+    source: TrialSourceSettings
+    stats: SpectralStatsSettings
+
+
+class EndToEnd(ez.Collection):
+    SETTINGS: EndToEndSettings
+
+    SOURCE = TrialSource()
+    STATS = SpectralStats()
+    ACK = StatsAck()
+
+    def configure(self) -> None:
+        self.SOURCE.apply_settings(self.SETTINGS.source)
+        self.STATS.apply_settings(self.SETTINGS.stats)
+
+    def network(self) -> ez.NetworkDefinition:
+        return (
+            (self.SOURCE.OUTPUT_SAMPLE, self.STATS.INPUT_SAMPLE),
+            (self.STATS.OUTPUT_STATS, self.ACK.INPUT_STATS),
+            (self.ACK.OUTPUT_ACK, self.SOURCE.INPUT_ACK),
+        )
+
+
+def _run(config: SyntheticConfig, n_trials: int, stats: SpectralStatsSettings) -> typing.List[float]:
+    system = EndToEnd(EndToEndSettings(
+        source = TrialSourceSettings(config = config, n_trials = n_trials),
+        stats = stats
+    ))
+    ez.run(BENCHMARK = system, force_single_process = True)
+    return system.SOURCE.STATE.latencies
+
+
+def bench_end_to_end(
+    config: SyntheticConfig,
+    n_trials: int,
+    stats: SpectralStatsSettings,
+    name: str = 'end_to_end',
+    traced_trials: int = 8
+) -> BenchmarkResult:
+    """
+    Round trip from publishing a trial into SpectralStats to receiving the
+    refreshed statistics, over a real single-process ezmsg graph.  Peak memory
+    comes from a second, shorter run under tracemalloc.
+    """
+    latencies = _run(config, n_trials, stats)
+
+    peak = None
+    if traced_trials > 0:
+        tracemalloc.start()
+        _run(config, traced_trials, stats)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return summarize(name, latencies, peak, dict(
+        n_trials = n_trials,
+        fused_spectrum = stats.fused_spectrum,
+        estimator = stats.estimator.name,
+        stats_test = stats.stats_test.name,
+        config = asdict(config)
+    ))
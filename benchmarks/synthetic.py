@@ -0,0 +1,115 @@
+import typing
+
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage, SampleTriggerMessage
+
+
+@dataclass(frozen = True)
+class SyntheticConfig:
+    fs: float = 250.0
+    n_channels: int = 8
+    freqs: typing.Tuple[float, ...] = (7.0, 9.0, 13.0) # targets; trials cycle through them
+    snr_db: float = -10.0 # SSVEP power over broadband noise power, per channel
+    n_harm: int = 2 # harmonic h has amplitude 1 / h
+    pink: bool = True # 1/f background rather than white
+    pre: float = 1.0 # sec of null data before each onset
+    post: float = 1.0 # sec of SSVEP data after each onset
+    iti: float = 4.0 # sec between trial onsets
+    seed: int = 0
+
+
+def background_noise(n_time: int, n_channels: int, rng: np.random.Generator, pink: bool = True) -> npt.NDArray:
+    """ (time x channel) unit-variance noise, shaped to a 1/f power spectrum if pink """
+    noise = rng.normal(size = (n_time, n_channels))
+    if pink:
+        spec = np.fft.rfft(noise, axis = 0)
+        spec[1:] /= np.sqrt(np.arange(1, spec.shape[0]))[:, None]
+        spec[0] = 0.0
+        noise = np.fft.irfft(spec, n = n_time, axis = 0)
+    return noise / noise.std(axis = 0)
+
+
+def ssvep_signal(
+    n_time: int,
+    fs: float,
+    freq: float,
+    gains: npt.NDArray,
+    snr_db: float,
+    n_harm: int,
+    rng: np.random.Generator
+) -> npt.NDArray:
+    """
+    (time x channel) harmonic response at freq with random phases, scaled per
+    channel by gains and overall so its power is snr_db relative to unit noise
+    """
+    t = np.arange(n_time) / fs
+    harm = np.arange(1, n_harm + 1)
+    phases = rng.uniform(0.0, 2.0 * np.pi, size = n_harm)
+    wave = np.sin(2.0 * np.pi * freq * np.outer(t, harm) + phases) @ (1.0 / harm)
+    power = np.sum((1.0 / harm) ** 2) / 2.0
+    return np.outer(wave * np.sqrt(10.0 ** (snr_db / 10.0) / power), gains)
+
+
+def synthetic_eeg(
+    duration: float,
+    config: SyntheticConfig,
+    freqs: typing.Optional[typing.Sequence[float]] = None,
+    onset: float = 0.0,
+    rng: typing.Optional[np.random.Generator] = None
+) -> npt.NDArray:
+    """
+    (time x channel) background noise with an SSVEP at each of freqs (default
+    all config.freqs) from onset seconds on.  Each channel picks up the
+    response with a random gain between 0.5 and 1.
+    """
+    rng = rng if rng is not None else np.random.default_rng(config.seed)
+    n_time = int(round(duration * config.fs))
+    first = int(round(onset * config.fs))
+    data = background_noise(n_time, config.n_channels, rng, config.pink)
+    gains = rng.uniform(0.5, 1.0, size = config.n_channels)
+    for freq in (freqs if freqs is not None else config.freqs):
+        data[first:] += ssvep_signal(n_time - first, config.fs, freq, gains, config.snr_db, config.n_harm, rng)
+    return data
+
+
+def synthetic_samples(n_trials: int, config: SyntheticConfig, t0: float = 0.0) -> typing.List[SampleMessage]:
+    """
+    Trials as the Sampler emits them: ('ch', 'time') samples spanning
+    [-pre, post) around each onset, triggered with the target frequency
+    as value and the time axis on the trigger clock.  Time is last, as the
+    sigproc Spectrum units inside SpectralStats require.
+    """
+    rng = np.random.default_rng(config.seed)
+    samples = []
+    for trial in range(n_trials):
+        freq = config.freqs[trial % len(config.freqs)]
+        timestamp = t0 + trial * config.iti
+        data = synthetic_eeg(config.pre + config.post, config, [freq], onset = config.pre, rng = rng)
+        samples.append(SampleMessage(
+            trigger = SampleTriggerMessage(timestamp = timestamp, period = (-config.pre, config.post), value = freq),
+            sample = AxisArray(
+                data.T,
+                dims = ['ch', 'time'],
+                axes = {'time': AxisArray.Axis.TimeAxis(config.fs, offset = timestamp - config.pre)}
+            )
+        ))
+    return samples
+
+
+def synthetic_stream(duration: float, block_dur: float, config: SyntheticConfig) -> typing.List[AxisArray]:
+    """ Consecutive ('time', 'ch') blocks of one continuous recording with an SSVEP at config.freqs[0] """
+    data = synthetic_eeg(duration, config, config.freqs[:1])
+    n_block = max(int(round(block_dur * config.fs)), 1)
+    return [
+        AxisArray(
+            data[start:start + n_block],
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.Axis.TimeAxis(config.fs, offset = start / config.fs)}
+        )
+        for start in range(0, data.shape[0] - n_block + 1, n_block)
+    ]
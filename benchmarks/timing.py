@@ -0,0 +1,104 @@
+import time
+import typing
+import tracemalloc
+
+from dataclasses import dataclass, field
+
+import numpy as np
+import numpy.typing as npt
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    n_iter: int
+    total_time: float # sec spent inside the timed calls
+    throughput: float # calls / sec
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+    peak_memory: typing.Optional[int] # bytes allocated at peak by a traced call
+    params: typing.Dict[str, typing.Any] = field(default_factory = dict)
+
+
+def summarize(
+    name: str,
+    durations: npt.ArrayLike,
+    peak_memory: typing.Optional[int],
+    params: typing.Optional[typing.Dict[str, typing.Any]] = None
+) -> BenchmarkResult:
+    durations = np.asarray(durations, dtype = float)
+    total = float(durations.sum())
+    return BenchmarkResult(
+        name = name,
+        n_iter = len(durations),
+        total_time = total,
+        throughput = len(durations) / total if total > 0.0 else float('inf'),
+        mean_ms = float(durations.mean() * 1e3),
+        p50_ms = float(np.percentile(durations, 50) * 1e3),
+        p99_ms = float(np.percentile(durations, 99) * 1e3),
+        peak_memory = peak_memory,
+        params = params if params is not None else {}
+    )
+
+
+def measure(
+    name: str,
+    fn: typing.Callable[[], typing.Any],
+    n_iter: int,
+    warmup: int = 3,
+    traced: int = 3,
+    params: typing.Optional[typing.Dict[str, typing.Any]] = None
+) -> BenchmarkResult:
+    """
+    Time n_iter calls of fn after warmup untimed ones.  Peak memory comes from
+    a separate pass of `traced` calls under tracemalloc, so its overhead never
+    reaches the timings.
+    """
+    for _ in range(warmup):
+        fn()
+
+    durations = []
+    for _ in range(n_iter):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+
+    peak = None
+    if traced > 0:
+        tracemalloc.start()
+        for _ in range(traced):
+            fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return summarize(name, durations, peak, params)
+
+
+async def measure_async(
+    name: str,
+    fn: typing.Callable[[], typing.Awaitable[typing.Any]],
+    n_iter: int,
+    warmup: int = 3,
+    traced: int = 3,
+    params: typing.Optional[typing.Dict[str, typing.Any]] = None
+) -> BenchmarkResult:
+    """ measure for coroutine functions, awaited on the running loop """
+    for _ in range(warmup):
+        await fn()
+
+    durations = []
+    for _ in range(n_iter):
+        start = time.perf_counter()
+        await fn()
+        durations.append(time.perf_counter() - start)
+
+    peak = None
+    if traced > 0:
+        tracemalloc.start()
+        for _ in range(traced):
+            await fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return summarize(name, durations, peak, params)
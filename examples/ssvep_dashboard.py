@@ -1,3 +1,5 @@
+import time
+
 from pathlib import Path
 
 import ezmsg.core as ez
@@ -23,13 +25,15 @@ from ezmsg.sigproc.sampler import Sampler, SamplerSettings
 
 from ezmsg.ssvep.ssvep import SSVEPStim
 from ezmsg.ssvep.spectralstats import SpectralStatsPanel, SpectralStatsSettings
+from ezmsg.ssvep.epocharchive import EpochArchiveRecorder, EpochArchiveRecorderSettings
 
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Optional
 
 class SSVEPSystemSettings( ez.Settings ):
     openbcisource_settings: OpenBCISourceSettings
     data_dir: Path
     stimserver_port: int = 8080
+    archive_dir: Optional[Path] = None
 
 
 class SSVEPSystem( ez.Collection ):
@@ -43,6 +47,7 @@ class SSVEPSystem( ez.Collection ):
     DECIMATE = Decimate()
     SAMPLER = Sampler()
     RECORDER = Recorder()
+    ARCHIVE = EpochArchiveRecorder()
     STATS = SpectralStatsPanel()
 
     APP = Application()
@@ -89,6 +94,13 @@ class SSVEPSystem( ez.Collection ):
             )
         )
 
+        self.ARCHIVE.apply_settings(
+            EpochArchiveRecorderSettings(
+                path = str(self.SETTINGS.archive_dir) 
+                    if self.SETTINGS.archive_dir is not None else None
+            )
+        )
+
         self.APP.apply_settings(
             ApplicationSettings(
                 port = 8083,
@@ -115,6 +127,7 @@ class SSVEPSystem( ez.Collection ):
             (self.STIM.OUTPUT_TRIGGER, self.SAMPLER.INPUT_TRIGGER),
             (self.DECIMATE.OUTPUT_SIGNAL, self.SAMPLER.INPUT_SIGNAL),
             (self.SAMPLER.OUTPUT_SAMPLE, self.RECORDER.INPUT_MESSAGE),
+            (self.SAMPLER.OUTPUT_SAMPLE, self.ARCHIVE.INPUT_SAMPLE),
 
             (self.SAMPLER.OUTPUT_SAMPLE, self.STATS.INPUT_SAMPLE),
         )
@@ -183,6 +196,13 @@ if __name__ == "__main__":
         default = Path.home() / 'ssvep_data'
     )
 
+    parser.add_argument(
+        '--archive',
+        action = 'store_true',
+        help = "Also write samples to a memory-mapped epoch archive in data-dir",
+        default = False
+    )
+
     class Args:
         device: str
         blocksize: int
@@ -191,6 +211,7 @@ if __name__ == "__main__":
         powerdown: str
         impedance: bool
         data_dir: Path
+        archive: bool
 
     args = parser.parse_args( namespace = Args )
 
@@ -229,7 +250,9 @@ if __name__ == "__main__":
             )
         ),
 
-        data_dir = args.data_dir
+        data_dir = args.data_dir,
+        archive_dir = ( args.data_dir / time.strftime( 'epochs_%Y%m%d_%H%M%S' ) 
+            if args.archive else None )
     )
 
     system = SSVEPSystem( settings )
@@ -0,0 +1,176 @@
+import functools
+import typing
+
+import numpy as np
+import numpy.typing as npt
+import scipy.fft
+import scipy.signal
+
+from .window import TrailingWindow
+
+
+@functools.lru_cache(maxsize = 32)
+def reference_templates(n_time: int, fs: float, freqs: typing.Tuple[float, ...], n_harm: int) -> npt.NDArray:
+    """
+    Sine/cosine reference bank for CCA decoding with shape (freq x time x 2 * n_harm).
+    Columns alternate sin/cos for harmonics 1..n_harm of each frequency.
+
+    Time starts at zero rather than at the window's absolute offset; a phase
+    shift stays within the span of each sin/cos pair, so canonical correlations
+    are unaffected and one bank serves every window of the same length.
+    The returned array is shared between callers and is read-only.
+    """
+    templates = sincos_references(np.arange(n_time) / fs, freqs, n_harm)
+    templates.flags.writeable = False
+    return templates
+
+
+def sincos_references(t: npt.NDArray, freqs: typing.Sequence[float], n_harm: int) -> npt.NDArray:
+    """ Sine/cosine references (freq x time x 2 * n_harm) evaluated at times t (seconds) """
+    harm = np.arange(1, n_harm + 1)
+    phase = 2.0 * np.pi * np.asarray(freqs, dtype = float)[:, None, None] * harm[None, None, :] * t[None, :, None]
+    references = np.empty((len(freqs), len(t), 2 * n_harm))
+    references[..., 0::2] = np.sin(phase)
+    references[..., 1::2] = np.cos(phase)
+    return references
+
+
+def orthonormal_basis(data: npt.NDArray, rtol: float = 1e-10) -> npt.NDArray:
+    """
+    Orthonormal basis for the column space of mean-centered data (... x time x n).
+    Computed via thin SVD so rank-deficient inputs (e.g. bridged channels or a
+    harmonic at Nyquist) contribute zero columns instead of spurious directions.
+    """
+    centered = data - data.mean(axis = -2, keepdims = True)
+    u, s, _ = np.linalg.svd(centered, full_matrices = False)
+    keep = s > rtol * np.max(s, axis = -1, keepdims = True)
+    return u * keep[..., None, :]
+
+
+@functools.lru_cache(maxsize = 32)
+def reference_bases(n_time: int, fs: float, freqs: typing.Tuple[float, ...], n_harm: int) -> npt.NDArray:
+    """ Cached orthonormal bases (freq x time x 2 * n_harm) of the centered reference templates """
+    bases = orthonormal_basis(reference_templates(n_time, fs, freqs, n_harm))
+    bases.flags.writeable = False
+    return bases
+
+
+def cca_correlations(data: npt.NDArray, bases: npt.NDArray) -> npt.NDArray:
+    """
+    Maximal canonical correlation between a (time x channel) window and each
+    reference basis from `reference_bases`, in closed form.
+
+    The window is whitened once; the canonical correlations against a basis are
+    then the singular values of the (channel x 2 * n_harm) product of the two
+    orthonormal bases, and every target is handled by one batched SVD.
+    """
+    q_data = orthonormal_basis(data)
+    prod = np.swapaxes(q_data, -1, -2)[..., None, :, :] @ bases
+    return np.linalg.svd(prod, compute_uv = False)[..., 0]
+
+
+
+class SlidingCca(TrailingWindow):
+    """
+    Canonical correlations over a trailing window of a continuous stream.
+
+    Keeps running sums of the data, the phase-continuous references and their
+    outer products over the window.  The correlations are solved from the
+    small (channel x 2 * n_harm) covariances through Cholesky whitening.
+    """
+
+    def __init__(
+        self, 
+        n_channels: int, 
+        fs: float, 
+        freqs: typing.Sequence[float], 
+        n_harm: int, 
+        n_window: int, 
+        recompute_every: int = 200
+    ) -> None:
+        self.fs = fs
+        self.freqs = tuple(freqs)
+        self.n_harm = n_harm
+        super().__init__(n_window, n_channels, recompute_every)
+
+    def _clear(self) -> None:
+        n_freqs, n_ref, n_ch = len(self.freqs), 2 * self.n_harm, self.n_channels
+        self._sx = np.zeros(n_ch)
+        self._sxx = np.zeros((n_ch, n_ch))
+        self._sy = np.zeros((n_freqs, n_ref))
+        self._syy = np.zeros((n_freqs, n_ref, n_ref))
+        self._sxy = np.zeros((n_freqs, n_ch, n_ref))
+
+    def _references(self, start: int, n: int) -> npt.NDArray:
+        return sincos_references(np.arange(start, start + n) / self.fs, self.freqs, self.n_harm)
+
+    def _accumulate(self, start: int, x: npt.NDArray, sign: float) -> None:
+        y = self._references(start, x.shape[0])
+        self._sx += sign * x.sum(axis = 0)
+        self._sxx += sign * (x.T @ x)
+        self._sy += sign * y.sum(axis = 1)
+        self._syy += sign * (np.swapaxes(y, -1, -2) @ y)
+        self._sxy += sign * (x.T[None, ...] @ y)
+
+    def correlations(self, ridge: float = 1e-9) -> npt.NDArray:
+        """ Leading canonical correlation for each frequency over the current window """
+        n = self._count
+        mx = self._sx / n
+        my = self._sy / n
+        cxx = self._sxx / n - np.outer(mx, mx)
+        cyy = self._syy / n - my[:, :, None] * my[:, None, :]
+        cxy = self._sxy / n - mx[None, :, None] * my[:, None, :]
+
+        # A small ridge keeps Cholesky defined for rank-deficient blocks
+        # (e.g. a harmonic at Nyquist or bridged channels)
+        cxx = cxx + ridge * np.trace(cxx) / len(cxx) * np.eye(len(cxx))
+        cyy = cyy + (ridge * np.trace(cyy, axis1 = -2, axis2 = -1) / cyy.shape[-1])[:, None, None] * np.eye(cyy.shape[-1])
+
+        whitened = np.linalg.solve(np.linalg.cholesky(cxx)[None, ...], cxy)
+        whitened = np.linalg.solve(np.linalg.cholesky(cyy), np.swapaxes(whitened, -1, -2))
+        rho = np.linalg.svd(whitened, compute_uv = False)[..., 0]
+        return np.clip(rho, 0.0, 1.0)
+
+
+@functools.lru_cache(maxsize = 16)
+def filterbank_response(n_time: int, fs: float, n_bands: int, band_start: float, band_stop: float, order: int = 4) -> npt.NDArray:
+    """
+    Squared magnitude response (band x rfft bin) of a Chebyshev type I sub-band
+    filter bank, sampled for zero-padded windows of n_time samples.  Band k
+    (1-based) passes [k * band_start, band_stop] Hz, as in Chen et al.'s FBCCA;
+    the upper edge is capped below Nyquist.  Using |H|^2 with no phase applies
+    each band forward and backward, like filtfilt.
+    """
+    n_fft = scipy.fft.next_fast_len(2 * n_time, real = True)
+    freqs = np.fft.rfftfreq(n_fft, d = 1.0 / fs)
+    high = min(band_stop, 0.45 * fs)
+    response = np.empty((n_bands, freqs.size))
+    for band in range(n_bands):
+        low = (band + 1) * band_start
+        if low >= high:
+            raise ValueError(f'Sub-band {band + 1} starts at {low} Hz, above its {high} Hz upper edge')
+        sos = scipy.signal.cheby1(order, 0.5, [low, high], btype = 'bandpass', fs = fs, output = 'sos')
+        _, h = scipy.signal.sosfreqz(sos, worN = freqs, fs = fs)
+        response[band] = np.abs(h) ** 2
+    response.flags.writeable = False
+    return response
+
+
+def filterbank(data: npt.NDArray, response: npt.NDArray) -> npt.NDArray:
+    """ Split (... x time x channel) data into sub-bands (... x band x time x channel) with one batched FFT """
+    n_time = data.shape[-2]
+    n_fft = 2 * (response.shape[-1] - 1)
+    spec = np.fft.rfft(data, n = n_fft, axis = -2)
+    bands = np.fft.irfft(spec[..., None, :, :] * response[:, :, None], n = n_fft, axis = -2)
+    return bands[..., :n_time, :]
+
+
+def fbcca_weights(n_bands: int, a: float = 1.25, b: float = 0.25) -> npt.NDArray:
+    """ Sub-band weights w(k) = k^-a + b """
+    return np.arange(1, n_bands + 1, dtype = float) ** -a + b
+
+
+def fbcca_scores(data: npt.NDArray, bases: npt.NDArray, response: npt.NDArray, weights: npt.NDArray) -> npt.NDArray:
+    """ FBCCA target scores: weighted sum over sub-bands of squared canonical correlations """
+    rho = cca_correlations(filterbank(data, response), bases)
+    return np.einsum('b,...bk->...k', weights, rho ** 2)
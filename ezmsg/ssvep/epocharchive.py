@@ -0,0 +1,235 @@
+import os
+import json
+import typing
+
+from pathlib import Path
+from dataclasses import asdict
+
+import numpy as np
+import numpy.typing as npt
+import ezmsg.core as ez
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage, SampleTriggerMessage
+
+DATA_FILE = 'data.bin'
+INDEX_FILE = 'index.json'
+TRIALS_FILE = 'trials.jsonl'
+ARCHIVE_VERSION = 2
+
+
+def _trial_nbytes(index: typing.Dict[str, typing.Any]) -> int:
+    return int(np.prod(index['shape'])) * np.dtype(index['dtype']).itemsize
+
+
+def _read_trials(path: Path, index: typing.Dict[str, typing.Any]) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Per-trial records of an archive, capped at the trials fully present in
+    data.bin.  A trailing record cut short by an interrupted write is dropped.
+    """
+    if 'trials' in index:
+        trials = index['trials'] # version 1 kept them inside the index
+    else:
+        trials = []
+        if (path / TRIALS_FILE).exists():
+            with open(path / TRIALS_FILE, 'r') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    trials.append(json.loads(line))
+
+    data_path = path / DATA_FILE
+    n_stored = data_path.stat().st_size // _trial_nbytes(index) if data_path.exists() else 0
+    return trials[:n_stored]
+
+
+class EpochArchiveWriter:
+    """
+    Appends SampleMessages to an epoch archive: a directory holding the raw
+    (trial x ...sample dims) array in data.bin, a small JSON index of axis
+    metadata and one JSON line of trigger information per trial in
+    trials.jsonl.  Every sample must share the first sample's dims, shape
+    and dtype.
+
+    Each append writes only the new trial's bytes and record.  When reopening
+    an archive, data.bin and trials.jsonl are cut back to the trials present
+    in both, so a write interrupted by a crash never misaligns later trials.
+    """
+
+    def __init__(self, path: typing.Union[str, Path], time_axis: str = 'time') -> None:
+        self.path = Path(path)
+        self.time_axis = time_axis
+        self.path.mkdir(parents = True, exist_ok = True)
+
+        self._index: typing.Optional[typing.Dict[str, typing.Any]] = None
+        self._n_trials = 0
+        if (self.path / INDEX_FILE).exists():
+            with open(self.path / INDEX_FILE, 'r') as f:
+                self._index = json.load(f)
+            trials = _read_trials(self.path, self._index)
+            self._n_trials = len(trials)
+
+            # Rewrite the records once (also moving version 1 records out of the
+            # index).  Records land before the index drops its own copy, so a
+            # crash part way leaves either the old or the new archive intact.
+            self._write_trials(trials)
+            self._index.pop('trials', None)
+            self._index['version'] = ARCHIVE_VERSION
+            self._write_index()
+
+        self._data = open(self.path / DATA_FILE, 'ab')
+        if self._index is not None:
+            self._data.truncate(self._n_trials * _trial_nbytes(self._index))
+        self._trials = open(self.path / TRIALS_FILE, 'a')
+
+    def __len__(self) -> int:
+        return self._n_trials
+
+    def append(self, msg: SampleMessage) -> None:
+        sample = msg.sample
+        if self._index is None:
+            self._index = dict(
+                version = ARCHIVE_VERSION,
+                dtype = sample.data.dtype.str,
+                shape = list(sample.shape),
+                dims = list(sample.dims),
+                time_axis = self.time_axis,
+                axes = {name: asdict(axis) for name, axis in sample.axes.items()}
+            )
+            self._write_index()
+        elif (
+            list(sample.dims) != self._index['dims'] or
+            list(sample.shape) != self._index['shape'] or
+            sample.data.dtype.str != self._index['dtype']
+        ):
+            raise ValueError(
+                f'Sample {sample.dims} {sample.shape} {sample.data.dtype} does not match the archive layout '
+                f'{self._index["dims"]} {self._index["shape"]} {self._index["dtype"]}'
+            )
+
+        # Data before its record: readers only trust records backed by data
+        trigger = msg.trigger
+        self._data.write(np.ascontiguousarray(sample.data).tobytes())
+        self._data.flush()
+        self._trials.write(self._encode(dict(
+            timestamp = trigger.timestamp,
+            period = list(trigger.period) if trigger.period is not None else None,
+            value = trigger.value,
+            time_offset = sample.get_axis(self.time_axis).offset
+        )))
+        self._trials.flush()
+        self._n_trials += 1
+
+    @staticmethod
+    def _encode(trial: typing.Dict[str, typing.Any]) -> str:
+        return json.dumps(trial, default = repr) + '\n'
+
+    def _write_trials(self, trials: typing.List[typing.Dict[str, typing.Any]]) -> None:
+        tmp_path = self.path / f'{TRIALS_FILE}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(self._encode(trial) for trial in trials)
+        os.replace(tmp_path, self.path / TRIALS_FILE)
+
+    def _write_index(self) -> None:
+        # Written beside and swapped in so readers never see a partial index
+        tmp_path = self.path / f'{INDEX_FILE}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f, default = repr)
+        os.replace(tmp_path, self.path / INDEX_FILE)
+
+    def close(self) -> None:
+        self._data.close()
+        self._trials.close()
+
+
+class EpochArchive:
+    """
+    Read-only view of an epoch archive.  `data` is a (trial x ...) memmap so
+    trials are sliced straight from disk without parsing or copying.
+    """
+
+    def __init__(self, path: typing.Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path / INDEX_FILE, 'r') as f:
+            self.index = json.load(f)
+        self.trials = _read_trials(self.path, self.index)
+
+        self.dims: typing.List[str] = self.index['dims']
+        self.time_axis: str = self.index['time_axis']
+        self.axes = {name: AxisArray.Axis(**axis) for name, axis in self.index['axes'].items()}
+        dtype = np.dtype(self.index['dtype'])
+        shape = (len(self.trials),) + tuple(self.index['shape'])
+        if shape[0] == 0:
+            self.data: npt.NDArray = np.empty(shape, dtype = dtype)
+        else:
+            self.data = np.memmap(self.path / DATA_FILE, dtype = dtype, mode = 'r', shape = shape)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def values(self) -> typing.List[typing.Any]:
+        """ Trigger value of every trial """
+        return [trial['value'] for trial in self.trials]
+
+    def trigger(self, idx: int) -> SampleTriggerMessage:
+        trial = self.trials[idx]
+        return SampleTriggerMessage(
+            timestamp = trial['timestamp'],
+            period = tuple(trial['period']) if trial['period'] is not None else None,
+            value = trial['value']
+        )
+
+    def __getitem__(self, idx: int) -> SampleMessage:
+        """ The idx'th trial as a SampleMessage whose data is a view into the memmap """
+        time_axis = AxisArray.Axis(**{
+            **self.index['axes'][self.time_axis],
+            'offset': self.trials[idx]['time_offset']
+        })
+        sample = AxisArray(
+            self.data[idx],
+            dims = self.dims,
+            axes = {**self.axes, self.time_axis: time_axis}
+        )
+        return SampleMessage(trigger = self.trigger(idx), sample = sample)
+
+    def samples(self) -> typing.Iterator[SampleMessage]:
+        return (self[idx] for idx in range(len(self)))
+
+
+def is_epoch_archive(path: typing.Union[str, Path]) -> bool:
+    return (Path(path) / INDEX_FILE).is_file()
+
+
+class EpochArchiveRecorderSettings(ez.Settings):
+    path: typing.Optional[str] = None # archive directory; None records nothing
+    time_axis: str = 'time'
+
+
+class EpochArchiveRecorderState(ez.State):
+    writer: typing.Optional[EpochArchiveWriter] = None
+
+
+class EpochArchiveRecorder(ez.Unit):
+    """ Writes incoming SampleMessages (e.g. from the Sampler) to an epoch archive """
+    SETTINGS: EpochArchiveRecorderSettings
+    STATE: EpochArchiveRecorderState
+
+    INPUT_SAMPLE = ez.InputStream(SampleMessage)
+
+    def initialize(self) -> None:
+        if self.SETTINGS.path is not None:
+            self.STATE.writer = EpochArchiveWriter(self.SETTINGS.path, self.SETTINGS.time_axis)
+
+    def shutdown(self) -> None:
+        if self.STATE.writer is not None:
+            self.STATE.writer.close()
+
+    @ez.subscriber(INPUT_SAMPLE)
+    async def on_sample(self, msg: SampleMessage) -> None:
+        if self.STATE.writer is None:
+            return
+        try:
+            self.STATE.writer.append(msg)
+        except ValueError as e:
+            ez.logger.warning(f'Discarding sample: {e}')
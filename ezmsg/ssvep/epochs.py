@@ -0,0 +1,24 @@
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage
+
+
+def onset_index(msg: SampleMessage, time_axis: str) -> int:
+    """ Sample index of the trigger onset within msg.sample.
+    Computed from the time axis offset when it shares a clock with the trigger
+    timestamp (as the Sampler produces), otherwise from the trigger period.
+    """
+    axis = msg.sample.get_axis(time_axis)
+    n_time = msg.sample.shape[msg.sample.get_axis_idx(time_axis)]
+    t0_idx = int(round((msg.trigger.timestamp - axis.offset) / axis.gain))
+    if not 0 <= t0_idx < n_time and msg.trigger.period is not None:
+        t0_idx = int(round(-msg.trigger.period[0] / axis.gain))
+    return min(max(t0_idx, 0), n_time - 1)
+
+
+def freq_index(spect: AxisArray, freq_axis: str, freq_range: slice) -> slice:
+    """ Index slice equivalent to spect.sel(freq_axis = freq_range) """
+    axis = spect.get_axis(freq_axis)
+    start = int(axis.index(freq_range.start)) if freq_range.start is not None else None
+    stop = int(axis.index(freq_range.stop)) if freq_range.stop is not None else None
+    step = int(freq_range.step / axis.gain) if freq_range.step is not None else None
+    return slice(start, stop, step)
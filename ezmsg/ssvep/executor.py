@@ -0,0 +1,24 @@
+import enum
+import typing
+
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class ExecutorType(enum.Enum):
+    NONE = "Inline (Event Loop)"
+    THREAD = "Thread Pool"
+    PROCESS = "Process Pool"
+
+
+def make_executor(executor: ExecutorType, max_workers: typing.Optional[int] = None) -> typing.Optional[Executor]:
+    """ Construct the pool for an ExecutorType; None means run inline on the event loop """
+    if executor == ExecutorType.THREAD:
+        return ThreadPoolExecutor(max_workers = max_workers)
+    elif executor == ExecutorType.PROCESS:
+        return ProcessPoolExecutor(max_workers = max_workers)
+    return None
+
+
+class OverflowPolicy(enum.Enum):
+    BLOCK = "Block (Backpressure)"
+    DROP_OLDEST = "Drop Oldest"
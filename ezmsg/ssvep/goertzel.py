@@ -0,0 +1,160 @@
+import typing
+
+from dataclasses import replace
+
+import ezmsg.core as ez
+import numpy as np
+import numpy.typing as npt
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from .window import TrailingWindow
+
+
+class SlidingDft(TrailingWindow):
+    """
+    DFT coefficients at arbitrary frequencies over a trailing window of a stream.
+
+    A sliding Goertzel/recursive DFT: each coefficient is a running sum of
+    x(m) * exp(-j w m) over the window, so an update costs block length x
+    channels x frequencies and not the window length.
+    """
+
+    def __init__(
+        self,
+        freqs: npt.ArrayLike,
+        fs: float,
+        n_window: int,
+        n_channels: int,
+        recompute_every: int = 200
+    ) -> None:
+        self.omega = 2.0 * np.pi * np.asarray(freqs, dtype = float) / fs
+        self.fs = fs
+        super().__init__(n_window, n_channels, recompute_every)
+
+    def _clear(self) -> None:
+        self._coefs = np.zeros((len(self.omega), self.n_channels), dtype = complex)
+
+    def _kernel(self, start: int, n: int) -> npt.NDArray:
+        return np.exp(-1j * np.outer(self.omega, np.arange(start, start + n)))
+
+    def _accumulate(self, start: int, block: npt.NDArray, sign: float) -> None:
+        self._coefs += sign * (self._kernel(start, block.shape[0]) @ block)
+
+    def power(self) -> npt.NDArray:
+        """ (freq x channel) power over the current window """
+        return np.abs(self._coefs) ** 2 / max(self._count, 1) ** 2
+
+
+def snr_frequencies(freqs: typing.Sequence[float], n_harm: int, n_noise: int, spacing: float) -> npt.NDArray:
+    """
+    (target x harmonic x 1 + 2 * n_noise) frequencies to track: each harmonic of
+    each target followed by n_noise neighbouring bins, `spacing` Hz apart, on
+    either side.
+    """
+    offsets = np.concatenate(([0], np.arange(1, n_noise + 1), -np.arange(1, n_noise + 1))) * spacing
+    harm = np.arange(1, n_harm + 1)
+    return np.asarray(freqs, dtype = float)[:, None, None] * harm[None, :, None] + offsets[None, None, :]
+
+
+def noise_mask(freqs: npt.NDArray, fs: float) -> npt.NDArray:
+    """
+    (target x harmonic x 2 * n_noise) mask of the neighbours from `snr_frequencies`
+    that lie strictly between 0 Hz and Nyquist.  Those outside would pick up DC,
+    the mirror image of the signal bin or aliases rather than noise.  Raises
+    ValueError if a harmonic, or all of its neighbours, fall outside that range.
+    """
+    inside = (freqs > 0.0) & (freqs < fs / 2.0)
+    if not inside[:, :, 0].all():
+        raise ValueError(f'Target harmonics {freqs[:, :, 0][~inside[:, :, 0]]} Hz are not between 0 Hz and Nyquist ({fs / 2.0} Hz)')
+    if not inside[:, :, 1:].any(axis = 2).all():
+        raise ValueError(f'Some target harmonics have no neighbouring bins between 0 Hz and Nyquist ({fs / 2.0} Hz)')
+    return inside[:, :, 1:]
+
+
+def narrowband_snr(power: npt.NDArray, mask: typing.Optional[npt.NDArray] = None) -> npt.NDArray:
+    """
+    SNR in dB from (target x harmonic x 1 + 2 * n_noise x ...) powers laid out as
+    in `snr_frequencies`: summed harmonic power over summed mean neighbour power.
+    Only neighbours set in `mask` (see `noise_mask`) enter the mean.
+    """
+    signal = power[:, :, 0].sum(axis = 1)
+    noise = power[:, :, 1:]
+    if mask is None:
+        noise = noise.mean(axis = 2)
+    else:
+        mask = mask.reshape(mask.shape + (1,) * (noise.ndim - mask.ndim))
+        noise = np.where(mask, noise, 0.0).sum(axis = 2) / mask.sum(axis = 2)
+    return 10.0 * np.log10(signal / noise.sum(axis = 1))
+
+
+class NarrowbandSnrSettings(ez.Settings):
+    freqs: typing.List[float] # Target (e.g. reversal) frequencies
+    n_harm: int = 2
+    n_noise: int = 4 # Neighbouring bins on each side used as the noise estimate
+    window_dur: float = 1.0 # Sets the bin spacing of the neighbours to 1 / window_dur
+    time_axis: str = 'time'
+    recompute_every: int = 200
+
+
+class NarrowbandSnrState(ez.State):
+    dft: typing.Optional[SlidingDft] = None
+    mask: typing.Optional[npt.NDArray] = None # neighbours used as noise, see noise_mask
+
+
+class NarrowbandSnr(ez.Unit):
+    """
+    Running per-channel SNR at a few known frequencies, from a sliding DFT that
+    only tracks the target harmonics and their neighbouring bins.
+
+    Input is a continuous stream of blocks; once the window has filled, each
+    block produces an AxisArray of SNR in dB shaped ('target', ...non-time dims).
+    """
+    SETTINGS: NarrowbandSnrSettings
+    STATE: NarrowbandSnrState
+
+    INPUT_SIGNAL = ez.InputStream(AxisArray)
+    OUTPUT_SNR = ez.OutputStream(AxisArray)
+
+    @ez.subscriber(INPUT_SIGNAL)
+    @ez.publisher(OUTPUT_SNR)
+    async def on_signal(self, msg: AxisArray) -> typing.AsyncGenerator:
+        time_axis = self.SETTINGS.time_axis
+        fs = 1.0 / msg.get_axis(time_axis).gain
+
+        with msg.view2d(time_axis) as X:
+            try:
+                dft = self._dft(X.shape[1], fs)
+            except ValueError as e:
+                ez.logger.warning(f'Discarding block: {e}')
+                return
+            dft.update(X)
+
+        if not dft.full:
+            return
+
+        n_targets = len(self.SETTINGS.freqs)
+        power = dft.power().reshape((n_targets, self.SETTINGS.n_harm, -1, dft.n_channels))
+        other_dims = [d for d in msg.dims if d != time_axis]
+        snr = narrowband_snr(power, self.STATE.mask).reshape(
+            (n_targets,) + tuple(msg.shape[msg.get_axis_idx(d)] for d in other_dims)
+        )
+
+        yield self.OUTPUT_SNR, replace(
+            msg,
+            data = snr,
+            dims = ['target'] + other_dims,
+            axes = {d: a for d, a in msg.axes.items() if d != time_axis}
+        )
+
+    def _dft(self, n_channels: int, fs: float) -> SlidingDft:
+        """ Sliding DFT for the current stream layout, rebuilt if it changes """
+        settings = self.SETTINGS
+        n_window = int(round(settings.window_dur * fs))
+        dft = self.STATE.dft
+        if dft is None or (dft.n_channels, dft.fs, dft.n_window) != (n_channels, fs, n_window):
+            freqs = snr_frequencies(settings.freqs, settings.n_harm, settings.n_noise, fs / n_window)
+            self.STATE.mask = noise_mask(freqs, fs)
+            dft = SlidingDft(freqs.ravel(), fs, n_window, n_channels, settings.recompute_every)
+            self.STATE.dft = dft
+        return dft
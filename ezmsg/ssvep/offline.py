@@ -0,0 +1,175 @@
+import typing
+
+from pathlib import Path
+from collections import deque
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.stats
+import ezmsg.core as ez
+
+from ezmsg.util.messages.axisarray import AxisArray, slice_along_axis
+from ezmsg.util.messagecodec import message_log
+from ezmsg.sigproc.sampler import SampleMessage
+
+from .spectra import positive_freq_axis
+from .epochs import onset_index, freq_index
+from .spectralstats import SpectralStatsSettings, StatsTest, compute_permutation_stats, epoch_spectrum_db
+from .epocharchive import EpochArchive, is_epoch_archive
+
+
+def load_samples(path: typing.Union[str, Path]) -> typing.List[SampleMessage]:
+    """
+    Every SampleMessage in a message log written by the Recorder/MessageLogger,
+    or in an epoch archive directory (as memmapped views)
+    """
+    if is_epoch_archive(path):
+        return list(EpochArchive(path).samples())
+    return [obj for obj in message_log(Path(path)) if isinstance(obj, SampleMessage)]
+
+
+def retained_trials(
+    timestamps: typing.Sequence[float],
+    max_trials: typing.Optional[int] = None,
+    max_age: typing.Optional[float] = None
+) -> typing.List[int]:
+    """ Indices of the trials SpectralStatsCalc still holds after storing these in order """
+    kept: "deque[int]" = deque()
+    for idx, timestamp in enumerate(timestamps):
+        while max_trials is not None and len(kept) >= max(max_trials, 1):
+            kept.popleft()
+        kept.append(idx)
+        while max_age is not None and timestamp - timestamps[kept[0]] > max_age:
+            kept.popleft()
+    return list(kept)
+
+
+def epoch_spectra(
+    samples: typing.Iterable[SampleMessage],
+    settings: SpectralStatsSettings,
+    trial_axis: str = 'trial'
+) -> typing.Optional[typing.Tuple[AxisArray, AxisArray]]:
+    """
+    Null (pre-onset) and SSVEP (post-onset) spectra of every usable sample,
+    stacked along a leading trial_axis.  Epochs are cut exactly as
+    SpectralStatsCalc.split_sample cuts them, and only those it would still
+    hold under max_trials and max_age are kept.  All of them go through a
+    single batched rfft with the configured estimator.  Returns None if no sample covers the integration time.
+    """
+    time_axis = settings.time_axis
+    epochs = []
+    timestamps = []
+    template: typing.Optional[AxisArray] = None
+    for msg in samples:
+        if msg.trigger.period is None:
+            continue
+
+        sample = msg.sample
+        axis = sample.get_axis(time_axis)
+        axis_idx = sample.get_axis_idx(time_axis)
+        n_samp = int(settings.integration_time / axis.gain)
+        t0_idx = onset_index(msg, time_axis)
+        if t0_idx - n_samp < 0 or t0_idx + n_samp > sample.shape[axis_idx]:
+            continue
+
+        epoch = slice_along_axis(sample.data, slice(t0_idx - n_samp, t0_idx + n_samp), axis_idx)
+        if template is None:
+            template = sample
+        elif sample.dims != template.dims or epoch.shape != epochs[0].shape:
+            ez.logger.warning('Skipping sample whose layout differs from the first sample')
+            continue
+        epochs.append(epoch)
+        timestamps.append(msg.trigger.timestamp)
+
+    if template is None:
+        return None
+    epochs = [epochs[idx] for idx in retained_trials(timestamps, settings.max_trials, settings.max_age)]
+
+    axis = template.get_axis(time_axis)
+    axis_idx = template.get_axis_idx(time_axis)
+    n_samp = int(settings.integration_time / axis.gain)
+
+    # (half x trial x ...) with the halves split along the time axis
+    data = np.stack(epochs)
+    halves = np.stack((
+        slice_along_axis(data, slice(0, n_samp), axis_idx + 1),
+        slice_along_axis(data, slice(n_samp, 2 * n_samp), axis_idx + 1)
+    ))
+    spectra = epoch_spectrum_db(halves, axis_idx + 2, axis.gain, settings)
+
+    dims = [trial_axis] + [settings.freq_axis if dim == time_axis else dim for dim in template.dims]
+    axes = {name: ax for name, ax in template.axes.items() if name != time_axis}
+    axes[settings.freq_axis] = positive_freq_axis(n_samp, axis.gain)
+    null = AxisArray(spectra[0], dims = dims, axes = axes)
+    ssvep = AxisArray(spectra[1], dims = dims, axes = axes)
+    return null, ssvep
+
+
+def spectral_stats(
+    null: AxisArray,
+    ssvep: AxisArray,
+    settings: SpectralStatsSettings,
+    trial_axis: str = 'trial'
+) -> typing.Optional[AxisArray]:
+    """
+    -log10(p) of a two-sided Mann-Whitney U test (or the configured permutation
+    test) between SSVEP and null spectra across trial_axis for every bin in
+    freq_range, in one vectorized call.  For spectra from epoch_spectra, which
+    applies max_trials and max_age, this matches the final message
+    SpectralStats publishes for the same samples.
+    """
+    trial_idx = ssvep.get_axis_idx(trial_axis)
+    if ssvep.shape[trial_idx] < 2:
+        return None
+
+    freq_axis = settings.freq_axis
+    freq_idx = freq_index(ssvep, freq_axis, settings.freq_range)
+    null = null.isel(**{freq_axis: freq_idx})
+    ssvep = ssvep.isel(**{freq_axis: freq_idx})
+
+    dims = [dim for dim in ssvep.dims if dim != trial_axis]
+    axes = {name: ax for name, ax in ssvep.axes.items() if name != trial_axis}
+
+    if settings.stats_test != StatsTest.MANN_WHITNEY:
+        diff = np.moveaxis(ssvep.data - null.data, trial_idx, 0)
+        inv_log10_p = compute_permutation_stats(diff, dims.index(freq_axis), settings)
+        return replace(ssvep, data = inv_log10_p, dims = dims, axes = axes)
+
+    stats = scipy.stats.mannwhitneyu(ssvep.data, null.data, alternative = 'two-sided', axis = trial_idx)
+    pvalue = stats.pvalue
+    correction = np.prod(pvalue.shape) if settings.multiple_comparisons else 1.0
+    return replace(ssvep, data = -np.log10(pvalue * correction), dims = dims, axes = axes)
+
+
+def analyze_samples(
+    samples: typing.Iterable[SampleMessage],
+    settings: SpectralStatsSettings
+) -> typing.Optional[AxisArray]:
+    spectra = epoch_spectra(samples, settings)
+    if spectra is None:
+        return None
+    return spectral_stats(*spectra, settings)
+
+
+def analyze_file(path: typing.Union[str, Path], settings: SpectralStatsSettings) -> typing.Optional[AxisArray]:
+    """ Spectral statistics over all trials of one recording; None if it has fewer than two """
+    return analyze_samples(load_samples(path), settings)
+
+
+def analyze_directory(
+    directory: typing.Union[str, Path],
+    settings: SpectralStatsSettings,
+    pattern: str = '*.txt',
+    max_workers: typing.Optional[int] = None
+) -> typing.Dict[Path, typing.Optional[AxisArray]]:
+    """
+    analyze_file for every recording matching pattern, fanned out across a
+    process pool.  Epoch archives are directories, so pick them up with a
+    pattern that matches their names (e.g. '*'); matched directories that are
+    not archives are skipped.
+    """
+    paths = sorted(path for path in Path(directory).glob(pattern) if path.is_file() or is_epoch_archive(path))
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+        results = pool.map(analyze_file, paths, [settings] * len(paths))
+        return dict(zip(paths, results))
@@ -0,0 +1,147 @@
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import numpy.typing as npt
+
+
+def paired_t(sums: npt.NDArray, sumsq: npt.NDArray, n: int) -> npt.NDArray:
+    """ One-sample t statistic of paired differences from their sums and sums of squares """
+    mean = sums / n
+    var = (sumsq - n * mean ** 2) / (n - 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = mean / np.sqrt(var / n)
+    return np.nan_to_num(t, nan = 0.0, posinf = 0.0, neginf = 0.0)
+
+
+def sign_flips(n: int, n_permutations: int, rng: np.random.Generator) -> npt.NDArray:
+    """ (n_permutations x n) random +/-1 relabelings of n paired trials """
+    return rng.integers(0, 2, size = (n_permutations, n)) * 2.0 - 1.0
+
+
+def all_sign_flips(n: int) -> npt.NDArray:
+    """ Every one of the 2^n relabelings, for exact tests on few trials """
+    bits = (np.arange(2 ** n)[:, None] >> np.arange(n)[None, :]) & 1
+    return bits * 2.0 - 1.0
+
+
+def run_masses(t: npt.NDArray) -> npt.NDArray:
+    """
+    Running sum of t within each contiguous run of nonzero values along the last
+    axis; the value at a run's final bin is that run's cluster mass.
+    """
+    csum = np.cumsum(t, axis = -1)
+    base = np.maximum.accumulate(np.where(t > 0, 0.0, csum), axis = -1)
+    return csum - base
+
+
+def max_cluster_mass(t: npt.NDArray, threshold: float) -> npt.NDArray:
+    """ Largest positive or negative cluster mass along the last axis, per leading index """
+    pos = run_masses(np.where(t > threshold, t, 0.0))
+    neg = run_masses(np.where(t < -threshold, -t, 0.0))
+    mass = np.maximum(pos, neg)
+    return mass.reshape(mass.shape[0], -1).max(axis = -1)
+
+
+def cluster_masses(t: npt.NDArray, threshold: float) -> npt.NDArray:
+    """ Mass of the cluster each bin belongs to (0 outside clusters), along the last axis """
+    out = np.zeros_like(t)
+    idx = np.broadcast_to(np.arange(t.shape[-1]), t.shape)
+    for sign in (1.0, -1.0):
+        supra = sign * t > threshold
+        masses = run_masses(np.where(supra, sign * t, 0.0))
+        # Each run's total sits at its last bin; look up the nearest run end to the right
+        run_end = supra & ~np.concatenate((supra[..., 1:], np.zeros_like(supra[..., :1])), axis = -1)
+        next_end = np.where(run_end, idx, t.shape[-1] - 1)
+        next_end = np.flip(np.minimum.accumulate(np.flip(next_end, -1), axis = -1), -1)
+        out = np.where(supra, np.take_along_axis(masses, next_end, axis = -1), out)
+    return out
+
+
+def _null_chunk(
+    diff: npt.NDArray,
+    sumsq: npt.NDArray,
+    flips: npt.NDArray,
+    statistic: typing.Callable[[npt.NDArray], npt.NDArray]
+) -> npt.NDArray:
+    t = paired_t(flips @ diff.reshape(diff.shape[0], -1), sumsq.reshape(-1), diff.shape[0])
+    return statistic(t.reshape((flips.shape[0],) + diff.shape[1:]))
+
+
+def permutation_null(
+    diff: npt.NDArray,
+    statistic: typing.Callable[[npt.NDArray], npt.NDArray],
+    n_permutations: int = 1000,
+    chunk_size: int = 256,
+    workers: int = 1,
+    seed: typing.Optional[int] = None
+) -> npt.NDArray:
+    """
+    Null distribution of statistic (permutation x ...bins -> permutation) under
+    random sign flips of (trial x ...bins) paired differences.  Every chunk of
+    permutations is one matmul over all bins; chunks bound memory and can run
+    on several threads, as NumPy releases the GIL.  All 2^n flips are used
+    instead when that is no more than n_permutations.
+    """
+    n = diff.shape[0]
+    sumsq = np.sum(diff ** 2, axis = 0)
+
+    exact = 2 ** n <= n_permutations
+    n_perm = 2 ** n if exact else n_permutations
+    starts = range(0, n_perm, chunk_size)
+    every_flip = all_sign_flips(n) if exact else None
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    def chunk(idx: int) -> npt.NDArray:
+        start = starts[idx]
+        size = min(chunk_size, n_perm - start)
+        if every_flip is not None:
+            flips = every_flip[start:start + size]
+        else:
+            # Seeded per chunk so results do not depend on the worker count
+            flips = sign_flips(n, size, np.random.default_rng([seed, idx]))
+        return _null_chunk(diff, sumsq, flips, statistic)
+
+    if workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            return np.concatenate(list(pool.map(chunk, range(len(starts)))))
+    return np.concatenate([chunk(idx) for idx in range(len(starts))])
+
+
+def permutation_pvalue(null: npt.NDArray, observed: npt.NDArray, n: int) -> npt.NDArray:
+    """
+    Share of the null distribution at or above each observed value.  An exact
+    null over all 2^n flips already holds the observed labeling, so it is used
+    as is; a Monte Carlo null gets the observed labeling added, (1 + k) / (1 + N).
+    """
+    count = len(null) - np.searchsorted(np.sort(null), observed, side = 'left')
+    if len(null) == 2 ** n:
+        return count / len(null)
+    return (1 + count) / (1 + len(null))
+
+
+def max_t_pvalue(diff: npt.NDArray, **kwargs: typing.Any) -> npt.NDArray:
+    """ Family-wise p-values per bin from the permutation distribution of max |t| """
+    n = diff.shape[0]
+    observed = np.abs(paired_t(diff.sum(axis = 0), np.sum(diff ** 2, axis = 0), n))
+    null = permutation_null(diff, lambda t: np.abs(t).reshape(t.shape[0], -1).max(axis = -1), **kwargs)
+    return permutation_pvalue(null, observed, n)
+
+
+def cluster_pvalue(diff: npt.NDArray, threshold: float, freq_idx: int, **kwargs: typing.Any) -> npt.NDArray:
+    """
+    Cluster-mass permutation p-values per bin.  Clusters are runs of adjacent
+    frequency bins (axis freq_idx of each trial) whose paired |t| exceeds
+    threshold; every bin of a cluster gets the cluster's family-wise p-value
+    and bins outside clusters get 1.
+    """
+    n = diff.shape[0]
+    diff = np.moveaxis(diff, freq_idx + 1, -1)
+    observed = paired_t(diff.sum(axis = 0), np.sum(diff ** 2, axis = 0), n)
+    null = permutation_null(diff, lambda t: max_cluster_mass(t, threshold), **kwargs)
+
+    mass = cluster_masses(observed, threshold)
+    pvalue = np.where(mass > 0, permutation_pvalue(null, mass, n), 1.0)
+    return np.moveaxis(pvalue, -1, freq_idx)
@@ -0,0 +1,113 @@
+import enum
+import typing
+import functools
+
+import numpy as np
+import numpy.typing as npt
+import scipy.signal
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+
+@functools.lru_cache(maxsize = 16)
+def hamming(n: int) -> npt.NDArray:
+    """ Cached, read-only Hamming window """
+    window = np.hamming(n)
+    window.flags.writeable = False
+    return window
+
+
+def positive_freq_axis(n: int, gain: float) -> AxisArray.Axis:
+    """ Frequency axis of a positive-frequency spectrum of n samples spaced by gain seconds """
+    return AxisArray.Axis(unit = 'Hz', gain = 1.0 / (gain * n), offset = 0.0)
+
+
+def periodogram_db(data: npt.NDArray, axis: int, gain: float) -> npt.NDArray:
+    """
+    Hamming-windowed power spectrum in relative dB along axis, keeping the
+    non-negative frequencies.  This reproduces the output of
+    ezmsg.sigproc.spectral.Spectrum with the default SpectrumSettings, but any
+    number of leading epochs can be transformed in a single rfft call.
+    """
+    n = data.shape[axis]
+    window = hamming(n).reshape((n,) + (1,) * (data.ndim - axis - 1))
+    scale = np.sum(window ** 2.0) * gain
+    spec = np.fft.rfft(data * window, axis = axis) / n
+
+    # Spectrum reports bins [0, n - n // 2) after its fftshift
+    spec = spec[(slice(None),) * axis + (slice(0, n - n // 2),)]
+    return 10.0 * np.log10((2.0 * (np.abs(spec) ** 2.0)) / scale)
+
+
+class SpectralEstimator(enum.Enum):
+    PERIODOGRAM = "Periodogram (Hamming)"
+    WELCH = "Welch (Hann segments)"
+    MULTITAPER = "Multitaper (DPSS)"
+
+
+@functools.lru_cache(maxsize = 16)
+def dpss_tapers(n: int, nw: float, k: int) -> npt.NDArray:
+    """ Cached, read-only (k x n) Slepian tapers with time-half-bandwidth product nw """
+    tapers = np.atleast_2d(scipy.signal.windows.dpss(n, nw, Kmax = k))
+    tapers.flags.writeable = False
+    return tapers
+
+
+@functools.lru_cache(maxsize = 16)
+def welch_tapers(n: int, n_segment: int, n_overlap: int) -> npt.NDArray:
+    """
+    Cached, read-only (segment x n) Hann windows, each zero outside its own
+    segment, so Welch averaging becomes a multitaper average on the full
+    n-point frequency grid.
+    """
+    n_segment = min(n_segment, n)
+    step = max(n_segment - n_overlap, 1)
+    starts = range(0, n - n_segment + 1, step)
+    tapers = np.zeros((len(starts), n))
+    window = scipy.signal.windows.hann(n_segment, sym = False)
+    for row, start in enumerate(starts):
+        tapers[row, start:start + n_segment] = window
+    tapers.flags.writeable = False
+    return tapers
+
+
+def tapered_power_db(data: npt.NDArray, axis: int, gain: float, tapers: npt.NDArray) -> npt.NDArray:
+    """
+    Power spectrum in relative dB along axis, averaged over a (taper x n) bank
+    of windows in one rfft over the taper axis.  Each taper is scaled as
+    periodogram_db scales its window, so a single Hamming taper reproduces it.
+    """
+    n = data.shape[axis]
+    x = np.moveaxis(data, axis, -1)[..., None, :] * tapers
+    spec = np.fft.rfft(x, axis = -1)[..., :n - n // 2] / n
+    scale = (np.sum(tapers ** 2.0, axis = -1) * gain)[:, None]
+    power = np.mean((2.0 * (np.abs(spec) ** 2.0)) / scale, axis = -2)
+    return np.moveaxis(10.0 * np.log10(power), -1, axis)
+
+
+def spectrum_db(
+    data: npt.NDArray,
+    axis: int,
+    gain: float,
+    estimator: SpectralEstimator = SpectralEstimator.PERIODOGRAM,
+    welch_segment: float = 0.5,
+    welch_overlap: float = 0.5,
+    taper_nw: float = 2.0,
+    n_tapers: typing.Optional[int] = None
+) -> npt.NDArray:
+    """
+    Relative dB power spectrum along axis from the chosen estimator, on the
+    same frequency grid as periodogram_db (see positive_freq_axis).
+    welch_segment is in seconds and welch_overlap a fraction of a segment;
+    n_tapers defaults to 2 * taper_nw - 1.
+    """
+    n = data.shape[axis]
+    if estimator == SpectralEstimator.WELCH:
+        n_segment = int(round(welch_segment / gain))
+        tapers = welch_tapers(n, n_segment, int(welch_overlap * min(n_segment, n)))
+    elif estimator == SpectralEstimator.MULTITAPER:
+        k = n_tapers if n_tapers is not None else max(int(2 * taper_nw) - 1, 1)
+        tapers = dpss_tapers(n, taper_nw, k)
+    else:
+        return periodogram_db(data, axis, gain)
+    return tapered_power_db(data, axis, gain, tapers)
@@ -1,28 +1,217 @@
+import enum
+import time
+
 import ezmsg.core as ez
 import numpy as np
+import numpy.typing as npt
 import asyncio 
 
 from sklearn.cross_decomposition import CCA
 from ezmsg.util.messages.axisarray import AxisArray #from ezmsg.eeg.eegmessage import EEGMessage
+from ezmsg.sigproc.sampler import SampleTriggerMessage
 from typing import (
     Optional,
     AsyncGenerator,
-    List
+    List,
+    Tuple
 ) 
 from dataclasses import field, dataclass, replace
+from collections import deque
+from functools import partial
+from concurrent.futures import Executor
+
+from .cca import (
+    reference_templates, 
+    reference_bases, 
+    cca_correlations, 
+    filterbank_response, 
+    fbcca_weights, 
+    fbcca_scores, 
+    SlidingCca
+)
+from .executor import ExecutorType, OverflowPolicy, make_executor
 
 @dataclass
 class TransformOutput:
     output: float
+    corrs: Optional[npt.NDArray] = None # canonical correlation (FBCCA: weighted score) for each of freqoi
+    latency: Optional[float] = None # DYNAMIC: seconds of data after the trigger used for the decision
+
+@dataclass
+class BatchTransformOutput:
+    output: npt.NDArray # decoded FoI for each window in the batch
+    corrs: npt.NDArray # (batch x freqoi) scores, as in TransformOutput.corrs
+
+@dataclass
+class DecodeMetrics:
+    queue_length: int # windows still in flight when this one was published
+    compute_time: float # seconds spent decoding this window in the worker
+    latency: float # seconds from arrival to publication
+    dropped: int # total windows discarded by OverflowPolicy.DROP_OLDEST
+
+class CcaDecoder(enum.Enum):
+    SKLEARN = "Iterative (sklearn CCA)"
+    CLOSED_FORM = "Closed Form (Batched SVD)"
+    FBCCA = "Filter Bank CCA"
+    STREAMING = "Streaming (Sliding Window)"
+    DYNAMIC = "Dynamic Window (Early Stopping)"
 
 class SpectralCcaSettings(ez.Settings):
 # Set our frequencies of interest to be selected from, and harmonics we'd like to check.
-    freqoi: List[float] = field( default_factory = list([7, 9, 13]) )
+    freqoi: List[float] = field( default_factory = lambda: [7, 9, 13] )
     n_harm: int = 3
     timedim: str = 'time'
+    # Optional axis of stacked windows; each message is then decoded as a batch
+    # and published on OUTPUT_BATCH_DECODE (stateless decoders only)
+    batchdim: Optional[str] = None
+    decoder: CcaDecoder = CcaDecoder.SKLEARN
+
+    # FBCCA only: sub-band k (1-based) passes [k * fb_start, fb_stop] Hz and
+    # contributes its squared correlations with weight k^-fb_a + fb_b
+    fb_bands: int = 5
+    fb_start: float = 8.0
+    fb_stop: float = 88.0
+    fb_a: float = 1.25
+    fb_b: float = 0.25
+
+    # STREAMING only: messages are consecutive blocks of a continuous stream and
+    # a decision is emitted per block over the trailing window_dur seconds
+    window_dur: float = 1.0
+    recompute_every: int = 200
+
+    # DYNAMIC only: the window grows from each INPUT_TRIGGER timestamp and a
+    # decision is emitted once the best target leads the runner-up by stop_margin,
+    # or its softmax(softmax_beta * corrs) confidence reaches stop_confidence,
+    # but never before min_window and no later than max_window seconds
+    min_window: float = 0.25
+    max_window: float = 2.0
+    stop_margin: Optional[float] = 0.1
+    stop_confidence: Optional[float] = None
+    softmax_beta: float = 20.0
+
+    # Stateless decoders (SKLEARN, CLOSED_FORM, FBCCA) can run off the event loop.
+    # Up to max_pending windows are in flight and results publish in arrival order.
+    executor: ExecutorType = ExecutorType.NONE
+    executor_workers: Optional[int] = None
+    max_pending: int = 4
+    overflow: OverflowPolicy = OverflowPolicy.BLOCK
+
+def check_settings(settings: SpectralCcaSettings) -> None:
+    """ Raise ValueError for settings the extractor cannot run with """
+    if settings.max_pending < 1:
+        raise ValueError(f'max_pending must be at least 1, not {settings.max_pending}')
+
+def early_stop(corrs: npt.NDArray, settings: SpectralCcaSettings) -> bool:
+    """ True once the correlations are decisive under the DYNAMIC stopping rules """
+    if len(corrs) < 2:
+        return True
+    runner_up, best = np.sort(corrs)[-2:]
+    if settings.stop_margin is not None and best - runner_up >= settings.stop_margin:
+        return True
+    if settings.stop_confidence is not None:
+        logits = settings.softmax_beta * (corrs - best)
+        if 1.0 / np.sum(np.exp(logits)) >= settings.stop_confidence:
+            return True
+    return False
+
+def decode_window(X: npt.NDArray, fs: float, settings: SpectralCcaSettings, cca: Optional[CCA] = None) -> npt.NDArray:
+    """
+    Score each FoI for (... x time x channel) windows with a stateless decoder;
+    returns (... x freqoi).  The closed-form decoders vectorize their SVDs
+    across any leading batch dimensions; sklearn CCA fits window by window.
+    """
+    if settings.decoder in (CcaDecoder.STREAMING, CcaDecoder.DYNAMIC):
+        raise ValueError(f'{settings.decoder.value} decoding is stateful; use SlidingCca')
+
+    # Harmonics desired for checking correlations is from settings (3) and can be played
+    # with in the future to adjust ITR or accuracy.
+    #
+    # The sine and cosine references for each FoI only depend on the window length,
+    # sampling rate, FoIs and harmonics, so they come from a cached bank rather than
+    # being rebuilt for every message.  Y_n, where n is the FoI, is of size
+    # (# of time points, 2*harmonics). # of time points can be changed by the Window
+    # size chosen in our System settings.
+    template_key = (X.shape[-2], fs, tuple(settings.freqoi), settings.n_harm)
+
+    if settings.decoder == CcaDecoder.CLOSED_FORM:
+        # Whiten the window once and get the leading canonical correlation
+        # for every FoI from one batched SVD against the cached bases.
+        return cca_correlations(X, reference_bases(*template_key))
+
+    if settings.decoder == CcaDecoder.FBCCA:
+        # All sub-bands come out of one rfft/irfft pair against the cached
+        # filter bank response, then go through the same batched SVD.
+        response = filterbank_response(
+            X.shape[-2], fs, settings.fb_bands, settings.fb_start, settings.fb_stop
+        )
+        weights = fbcca_weights(settings.fb_bands, settings.fb_a, settings.fb_b)
+        return fbcca_scores(X, reference_bases(*template_key), response, weights)
+
+    if cca is None:
+        cca = CCA(n_components=3)
+
+    if X.ndim > 2:
+        windows = X.reshape((-1,) + X.shape[-2:])
+        allcores = np.stack([decode_window(x, fs, settings, cca) for x in windows])
+        return allcores.reshape(X.shape[:-2] + (-1,))
+
+    Y_bank = reference_templates(*template_key)
+
+    # Main code block.
+    # allcores will contain all the correlation coefficients produced by sklearn CCA funtion
+    # for the (3) frequencies of interest.
+    # Since the fit_transform function does not output correlations, but outputs the the
+    # covariance matrices maximizing the relationship between msg.data and Y, we use
+    # np.corrcoef to calculate and add the correlation values to allcores.
+    allcores = []
+    for Y in Y_bank:
+        A, B = cca.fit_transform(X, Y)
+        corrs = [np.corrcoef(A[:, i], B[:, i])[0, 1] for i in range(cca.n_components)]
+        allcores.append(corrs[0])
+
+    return np.array(allcores)
+
+def decode_batch(X: npt.NDArray, fs: float, settings: SpectralCcaSettings) -> Tuple[npt.NDArray, npt.NDArray]:
+    """
+    Decode a (batch x time x channel) stack of windows outside of ezmsg, through
+    the same code path as SpectralCcaExtractor.  Returns the decoded FoI and the
+    (batch x freqoi) scores.
+    """
+    allcores = decode_window(X, fs, settings)
+    return np.asarray(settings.freqoi)[np.argmax(allcores, axis = -1)], allcores
+
+def as_windows(msg: AxisArray, timedim: str, batchdim: Optional[str] = None) -> npt.NDArray:
+    """ (time x channel) data of msg, or (batch x time x channel) if batchdim is given """
+    if batchdim is None:
+        return msg.as2d(timedim)
+    data = np.moveaxis(msg.data, [msg.get_axis_idx(batchdim), msg.get_axis_idx(timedim)], [0, 1])
+    return data.reshape(data.shape[:2] + (-1,))
+
+def timed_decode(X: npt.NDArray, fs: float, settings: SpectralCcaSettings) -> Tuple[npt.NDArray, float]:
+    """ decode_window for worker pools; also returns the compute time in seconds """
+    start = time.perf_counter()
+    allcores = decode_window(X, fs, settings)
+    return allcores, time.perf_counter() - start
+
+@dataclass
+class _PendingDecode:
+    future: asyncio.Future
+    arrival: float
+    freqoi: List[float]
+    batched: bool
 
 class SpectralCcaState(ez.State):
+    cur_settings: SpectralCcaSettings
+    cca: CCA
     sampFreq: Optional[float] = None #
+    sliding: Optional[SlidingCca] = None
+    onset: Optional[float] = None
+
+    executor: Optional[Executor] = None
+    pending: deque # of _PendingDecode, oldest first
+    pending_ev: asyncio.Event # set when a window is submitted
+    popped_ev: asyncio.Event # set when a result leaves the queue
+    dropped: int = 0
 
 class SpectralCcaExtractor(ez.Unit):
     """
@@ -31,47 +220,191 @@ class SpectralCcaExtractor(ez.Unit):
     SETTINGS: SpectralCcaSettings
     STATE: SpectralCcaState
     
+    INPUT_SETTINGS = ez.InputStream(SpectralCcaSettings)
+    INPUT_TRIGGER = ez.InputStream(SampleTriggerMessage)
+
     # We dont know what they'll be named, we need to take in additional setting to tell us which
     # axis is the time axis, flattening the representation and everything in the datastream not the time axis is
     # a channel. That setting is timedim  
     INPUT_SIGNAL = ez.InputStream(AxisArray) 
     OUTPUT_DECODE = ez.OutputStream(TransformOutput)
+    OUTPUT_BATCH_DECODE = ez.OutputStream(BatchTransformOutput)
+    OUTPUT_METRICS = ez.OutputStream(DecodeMetrics)
+
+    def initialize(self) -> None:
+        check_settings(self.SETTINGS)
+        self.STATE.cur_settings = self.SETTINGS
+        # n_components here are the number of distinct frequencies we would like to search for
+        # correlations with the incoming data of the BCI (3 in this case).
+        self.STATE.cca = CCA(n_components=3)
+
+        self.STATE.executor = make_executor(
+            self.STATE.cur_settings.executor,
+            self.STATE.cur_settings.executor_workers
+        )
+        self.STATE.pending = deque()
+        self.STATE.pending_ev = asyncio.Event()
+        self.STATE.popped_ev = asyncio.Event()
+
+    def shutdown(self) -> None:
+        for job in self.STATE.pending:
+            job.future.cancel()
+        if self.STATE.executor is not None:
+            self.STATE.executor.shutdown(wait = False)
+
+    @ez.subscriber(INPUT_SETTINGS)
+    async def on_settings(self, msg: SpectralCcaSettings) -> None:
+        try:
+            check_settings(msg)
+        except ValueError as e:
+            ez.logger.warning(f'Ignoring settings: {e}')
+            return
+
+        old = self.STATE.cur_settings
+        if (msg.executor, msg.executor_workers) != (old.executor, old.executor_workers):
+            # Windows already submitted still finish and publish in order
+            if self.STATE.executor is not None:
+                self.STATE.executor.shutdown(wait = False)
+            self.STATE.executor = make_executor(msg.executor, msg.executor_workers)
+
+        self.STATE.cur_settings = msg
+        # Templates are keyed on settings; drop banks that can no longer be hit
+        reference_templates.cache_clear()
+        reference_bases.cache_clear()
+        filterbank_response.cache_clear()
+        self.STATE.sliding = None
+
+    @ez.subscriber(INPUT_TRIGGER)
+    async def on_trigger(self, msg: SampleTriggerMessage) -> None:
+        # Start a new growing window for DYNAMIC decoding
+        self.STATE.onset = msg.timestamp
+        if self.STATE.sliding is not None:
+            self.STATE.sliding.reset()
+
     @ez.subscriber(INPUT_SIGNAL)
     @ez.publisher(OUTPUT_DECODE)
+    @ez.publisher(OUTPUT_BATCH_DECODE)
     async def extract(self, msg: AxisArray) -> AsyncGenerator:
-        # n_components here are the number of distinct frequencies we would like to search for
-        # correlations with the incoming data of the BCI (3 in this case).
-        cca = CCA(n_components=3)
-        # Time formed from the message 'n_time' data (1, 2, 3...) and dividing by
-        # sampling frequency (500 Hz).[0.000, 0.002, 0.004,...]
-        #
-        # Harmonics desired for checking correlations is from settings (3) and can be played
-        # with in the future to adjust ITR or accuracy.
-        #TODO: Need to see if this is correct below. Im following along from spectral.py
-        time = msg.ax(self.SETTINGS.timedim).values
-        harm_idx = (np.arange(self.SETTINGS.n_harm)+1)
-        
-        # Main code block.
-        # allcores will contain all the correlation coefficients produced by sklearn CCA funtion
-        # for the (3) frequencies of interest.
-        # Y contains all of the sine and cosine functions and their harmonics for each FoI. Y_n,
-        # where n is the FoI, should be of size (# of time points, 2*harmonics). # of time points
-        # can be changed by the Window size chosen in our System settings.
-        # Since the fit_transform function does not output correlations, but outputs the the
-        # covariance matrices maximizing the relationship between msg.data and Y, we use
-        # np.corrcoef to calculate and add the correlation values to allcores.
-        allcores = []
-        for f in self.SETTINGS.freqoi:
-            Y =[]
-            for h in harm_idx:
-                Y.append(np.sin(2*np.pi*f*h*time))
-                Y.append(np.cos(2*np.pi*f*h*time))
-            Y = np.array(Y).T
-            A, B = cca.fit_transform(msg.view2d(self.SETTINGS.timedim), Y ) #we're using view2D to 
-            #flatten the data along the time axis 0, and every other axis is flattened to axis 1 
-            corrs = [np.corrcoef(A[:, i], B[:, i])[0, 1] for i in range(cca.n_components)]
-            allcores.append(corrs[0])
-
-        max_freq = self.SETTINGS.freqoi[np.argmax(allcores)]
-        
-        yield (self.OUTPUT_DECODE, TransformOutput(max_freq))
\ No newline at end of file
+        settings = self.STATE.cur_settings
+        cca = self.STATE.cca
+
+        axis = msg.get_axis(settings.timedim)
+        n_time = msg.shape[msg.get_axis_idx(settings.timedim)]
+        fs = 1.0 / axis.gain
+
+        if settings.decoder == CcaDecoder.STREAMING:
+            with msg.view2d(settings.timedim) as X:
+                sliding = self._sliding(X.shape[1], fs, settings.window_dur)
+                sliding.update(X)
+            if sliding.full:
+                allcores = sliding.correlations()
+                max_freq = settings.freqoi[np.argmax(allcores)]
+                yield (self.OUTPUT_DECODE, TransformOutput(max_freq, allcores))
+            return
+
+        if settings.decoder == CcaDecoder.DYNAMIC:
+            if self.STATE.onset is None:
+                return
+            first = max(int(np.ceil((self.STATE.onset - axis.offset) * fs)), 0)
+            if first >= n_time:
+                return
+            with msg.view2d(settings.timedim) as X:
+                growing = self._sliding(X.shape[1], fs, settings.max_window)
+                growing.update(X[first:first + growing.n_window - growing.n_samples])
+            if growing.n_samples < settings.min_window * fs:
+                return
+            allcores = growing.correlations()
+            if growing.full or early_stop(allcores, settings):
+                self.STATE.onset = None
+                max_freq = settings.freqoi[np.argmax(allcores)]
+                yield (self.OUTPUT_DECODE, TransformOutput(max_freq, allcores, growing.n_samples / fs))
+            return
+
+        if self.STATE.executor is None:
+            # Windows still in flight from a previous executor publish first
+            while self.STATE.pending:
+                self.STATE.popped_ev.clear()
+                await self.STATE.popped_ev.wait()
+
+            if settings.batchdim is not None:
+                allcores = decode_window(as_windows(msg, settings.timedim, settings.batchdim), fs, settings, cca)
+                yield (self.OUTPUT_BATCH_DECODE, self._batch_output(settings.freqoi, allcores))
+                return
+
+            with msg.view2d(settings.timedim) as X: #we're using view2D to
+                #flatten the data along the time axis 0, and every other axis is flattened to axis 1
+                allcores = decode_window(X, fs, settings, cca)
+
+            max_freq = settings.freqoi[np.argmax(allcores)]
+
+            yield (self.OUTPUT_DECODE, TransformOutput(max_freq, allcores))
+            return
+
+        # Off-loop decoding; publish_decodes emits the results in order
+        pending = self.STATE.pending
+        while len(pending) >= settings.max_pending:
+            if settings.overflow == OverflowPolicy.DROP_OLDEST:
+                pending.popleft().future.cancel()
+                self.STATE.dropped += 1
+            else:
+                self.STATE.popped_ev.clear()
+                await self.STATE.popped_ev.wait()
+
+        X = np.array(as_windows(msg, settings.timedim, settings.batchdim))
+        job = partial(timed_decode, X, fs, settings)
+        future = asyncio.get_running_loop().run_in_executor(self.STATE.executor, job)
+        pending.append(_PendingDecode(future, time.monotonic(), settings.freqoi, settings.batchdim is not None))
+        self.STATE.pending_ev.set()
+
+    @ez.publisher(OUTPUT_DECODE)
+    @ez.publisher(OUTPUT_BATCH_DECODE)
+    @ez.publisher(OUTPUT_METRICS)
+    async def publish_decodes(self) -> AsyncGenerator:
+        pending = self.STATE.pending
+        while True:
+            if not pending:
+                self.STATE.pending_ev.clear()
+                await self.STATE.pending_ev.wait()
+                continue
+
+            job = pending[0]
+            await asyncio.wait((job.future,))
+            if not pending or pending[0] is not job:
+                continue # dropped while we waited
+
+            pending.popleft()
+            self.STATE.popped_ev.set()
+            try:
+                allcores, compute_time = job.future.result()
+            except Exception as e:
+                ez.logger.warning(f'CCA decode failed: {e}')
+                continue
+
+            if job.batched:
+                yield (self.OUTPUT_BATCH_DECODE, self._batch_output(job.freqoi, allcores))
+            else:
+                max_freq = job.freqoi[np.argmax(allcores)]
+                yield (self.OUTPUT_DECODE, TransformOutput(max_freq, allcores))
+            yield (self.OUTPUT_METRICS, DecodeMetrics(
+                queue_length = len(pending),
+                compute_time = compute_time,
+                latency = time.monotonic() - job.arrival,
+                dropped = self.STATE.dropped
+            ))
+
+    @staticmethod
+    def _batch_output(freqoi: List[float], allcores: npt.NDArray) -> BatchTransformOutput:
+        return BatchTransformOutput(np.asarray(freqoi)[np.argmax(allcores, axis = -1)], allcores)
+
+    def _sliding(self, n_channels: int, fs: float, window_dur: float) -> SlidingCca:
+        """ Streaming accumulator for the current stream layout, rebuilt if it changes """
+        settings = self.STATE.cur_settings
+        n_window = int(round(window_dur * fs))
+        sliding = self.STATE.sliding
+        if sliding is None or (sliding.n_channels, sliding.fs, sliding.n_window) != (n_channels, fs, n_window):
+            sliding = SlidingCca(
+                n_channels, fs, settings.freqoi, settings.n_harm, n_window, 
+                recompute_every = settings.recompute_every
+            )
+            self.STATE.sliding = sliding
+        return sliding
@@ -1,15 +1,19 @@
+import enum
+import time
 import asyncio
 import typing
-from dataclasses import replace
+from collections import deque
+from functools import partial
+from dataclasses import replace, field
+from concurrent.futures import Executor, ThreadPoolExecutor
 
 import panel
-import scipy.stats
 
 import numpy as np
 import numpy.typing as npt
 import ezmsg.core as ez
 
-from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.util.messages.axisarray import AxisArray, slice_along_axis
 
 from ezmsg.sigproc.sampler import SampleMessage
 from ezmsg.sigproc.spectral import Spectrum, SpectrumSettings
@@ -17,21 +21,93 @@ from ezmsg.panel.lineplot import LinePlot, LinePlotSettings, AxisScale
 
 from param.parameterized import Event
 
+from .rankstats import IncrementalMannWhitneyU, MannWhitneySnapshot
+from .executor import ExecutorType, make_executor
+from .spectra import SpectralEstimator, spectrum_db, positive_freq_axis
+from .permutation import max_t_pvalue, cluster_pvalue
+from .epochs import onset_index, freq_index
+
+
+class StatsTest(enum.Enum):
+    MANN_WHITNEY = "Mann-Whitney U (Bonferroni)"
+    PERMUTATION_MAX = "Permutation (max-t)"
+    PERMUTATION_CLUSTER = "Permutation (cluster mass)"
+
 
 class SpectralStatsSettings(ez.Settings):
     time_axis: str
     integration_time: float
     freq_axis: str = 'freq'
-    freq_range: slice = slice(None)
+    freq_range: slice = field( default_factory = lambda: slice(None) )
     multiple_comparisons: bool = True
 
+    # Permutation tests of the paired SSVEP - null differences control the
+    # family-wise error through the null distribution instead of Bonferroni
+    stats_test: StatsTest = StatsTest.MANN_WHITNEY
+    n_permutations: int = 1000
+    cluster_threshold: float = 2.0 # |t| forming clusters of adjacent frequency bins
+    permutation_chunk: int = 256 # permutations per matmul; bounds memory
+    permutation_workers: int = 1 # threads sharing the permutation chunks
+    permutation_seed: typing.Optional[int] = None
+
+    # Compute both spectra inside SpectralStatsCalc with one stacked rfft instead
+    # of round-tripping each epoch half through a separate Spectrum unit
+    fused_spectrum: bool = False
+
+    # Lower-variance estimates average several tapers per epoch half; anything
+    # but the periodogram is computed on the fused path
+    estimator: SpectralEstimator = SpectralEstimator.PERIODOGRAM
+    welch_segment: float = 0.5 # sec
+    welch_overlap: float = 0.5 # fraction of a segment
+    taper_nw: float = 2.0 # DPSS time-half-bandwidth product
+    n_tapers: typing.Optional[int] = None # None uses 2 * taper_nw - 1
+
+    # Samples may stack several trials (e.g. during replay) along this axis;
+    # they share one trigger and are split at the same onset.  Stacked samples
+    # always take the fused path, in any dim order, since the sigproc Spectrum
+    # window only broadcasts for some layouts.
+    trial_axis: typing.Optional[str] = None
+
+    # Only bins within freq_range are kept; float32 halves the history's footprint
+    store_dtype: npt.DTypeLike = np.float64
+    store_capacity: int = 64 # trials preallocated up front
+
+    # Bound the history for always-on use; None keeps every trial until reset
+    max_trials: typing.Optional[int] = None # keep only the most recent trials
+    max_age: typing.Optional[float] = None # sec; drop trials triggered this long before the newest
+
+    # Where p-values are computed.  With any executor, the fused spectra and
+    # the rank-stat accumulation also leave the event loop: they run on one
+    # dedicated thread that owns the accumulator, so samples keep flowing.
+    executor: ExecutorType = ExecutorType.NONE
+    executor_workers: typing.Optional[int] = None
+    drop_stale_stats: bool = False # discard a finished result if a newer refresh is already pending, never twice in a row
+
+    # Publication throttling for the dashboard; pending refreshes are merged
+    max_publish_rate: typing.Optional[float] = None # Hz; None publishes on every refresh
+    publish_on_change: bool = False # skip refreshes when no trial was added, evicted or reset
+
 class SpectralStatsState(ez.State):
     cur_settings: SpectralStatsSettings
     spect_null_queue: "asyncio.Queue[AxisArray]"
     spect_ssvep_queue: "asyncio.Queue[AxisArray]"
-    spectra_null: typing.List[AxisArray]
-    spectra_ssvep: typing.List[AxisArray]
+    sample_times: "deque[float]" # trigger timestamps awaiting spectra
+    trial_times: "deque[float]" # trigger timestamps of stored trials
+
+    # Resolved from the first spectrum after a reset
+    spectrum_layout: typing.Optional[typing.Tuple[typing.Any, ...]]
+    freq_idx: typing.Optional[slice]
+    stats_template: typing.Optional[AxisArray]
+
+    mwu: IncrementalMannWhitneyU
     refresh_stats: asyncio.Event
+    executor: typing.Optional[Executor]
+    owner: typing.Optional[ThreadPoolExecutor] # sole mutator of the accumulator; None runs inline
+
+    stats_version: int # bumped whenever the stored trials change
+    published_version: typing.Optional[int]
+    last_publish: float # time.monotonic() of the last publish
+    dropped_stats: bool # the last finished result was discarded as stale
 
 class SpectralStatsCalc(ez.Unit):
     SETTINGS: SpectralStatsSettings
@@ -55,10 +131,46 @@ class SpectralStatsCalc(ez.Unit):
         self.STATE.cur_settings = self.SETTINGS
         self.STATE.spect_null_queue = asyncio.Queue()
         self.STATE.spect_ssvep_queue = asyncio.Queue()
+        self.STATE.sample_times = deque()
+        self.STATE.trial_times = deque()
         self.STATE.refresh_stats = asyncio.Event()
         self.STATE.refresh_stats.clear()
-        self.STATE.spectra_null = list()
-        self.STATE.spectra_ssvep = list()
+        self.STATE.stats_version = 0
+        self.STATE.published_version = None
+        self.STATE.last_publish = -float('inf')
+        self.STATE.dropped_stats = False
+        self.STATE.spectrum_layout = None
+        self.STATE.freq_idx = None
+        self.STATE.stats_template = None
+        self.STATE.mwu = IncrementalMannWhitneyU(
+            dtype = self.SETTINGS.store_dtype,
+            capacity = (
+                self.SETTINGS.max_trials 
+                if self.SETTINGS.max_trials is not None 
+                else self.SETTINGS.store_capacity
+            )
+        )
+        self.STATE.executor = make_executor(
+            self.SETTINGS.executor,
+            self.SETTINGS.executor_workers
+        )
+        self.STATE.owner = ThreadPoolExecutor(max_workers = 1) if self.STATE.executor is not None else None
+
+    def shutdown(self) -> None:
+        if self.STATE.executor is not None:
+            self.STATE.executor.shutdown(wait = False)
+        if self.STATE.owner is not None:
+            self.STATE.owner.shutdown(wait = False)
+
+    async def run_owned(self, fn: typing.Callable[..., typing.Any], *args: typing.Any) -> typing.Any:
+        """ Run fn on the thread that owns the accumulator, or inline without an executor.
+        Everything that touches the stored trials goes through here, so jobs run
+        one at a time and in the order they were submitted.
+        """
+        if self.STATE.owner is None:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.STATE.owner, partial(fn, *args))
 
     @ez.subscriber(INPUT_SETTINGS)
     async def on_settings(self, msg: SpectralStatsSettings) -> None:
@@ -76,21 +188,65 @@ class SpectralStatsCalc(ez.Unit):
         the post-zero strobing period; yielding these outputs on
         two separate outputs for spectral extraction and later 
         synchronization for statistics. 
+
+        Both outputs are views into the incoming sample.  If the sample
+        carries the configured trial_axis, every trial along it is split
+        at the same onset and both halves go through the fused path.
         """
 
         if msg.trigger.period is None:
             ez.logger.info('Incoming sample has no period; discarding')
             return
 
-        axis = msg.sample.get_axis(self.STATE.cur_settings.time_axis)
-        axis_idx = msg.sample.get_axis_idx(self.STATE.cur_settings.time_axis)
-        t = (np.arange(msg.sample.shape[axis_idx]) * axis.gain) + msg.trigger.period[0]
-        t0_idx = np.argmin(np.abs(t)).item()
+        time_axis = self.STATE.cur_settings.time_axis
+        axis = msg.sample.get_axis(time_axis)
+        axis_idx = msg.sample.get_axis_idx(time_axis)
+        n_time = msg.sample.shape[axis_idx]
         n_samp = int(self.STATE.cur_settings.integration_time / axis.gain)
-        null_data = msg.sample.data[(slice(None),) * axis_idx + (slice(t0_idx - n_samp, t0_idx),)]
-        ssvep_data = msg.sample.data[(slice(None),) * axis_idx + (slice(t0_idx, t0_idx + n_samp),)]
-        yield self.OUTPUT_NULL_SIGNAL, replace(msg.sample, data = null_data)
-        yield self.OUTPUT_SSVEP_SIGNAL, replace(msg.sample, data = ssvep_data)
+
+        t0_idx = onset_index(msg, time_axis)
+        if t0_idx - n_samp < 0 or t0_idx + n_samp > n_time:
+            ez.logger.info('Incoming sample does not cover the integration time around onset; discarding')
+            return
+
+        null_data = slice_along_axis(msg.sample.data, slice(t0_idx - n_samp, t0_idx), axis_idx)
+        ssvep_data = slice_along_axis(msg.sample.data, slice(t0_idx, t0_idx + n_samp), axis_idx)
+
+        settings = self.STATE.cur_settings
+        stacked = settings.trial_axis is not None and settings.trial_axis in msg.sample.dims
+        if stacked or settings.fused_spectrum or settings.estimator != SpectralEstimator.PERIODOGRAM:
+            # One rfft over both halves; the pair goes straight into the store
+            await self.run_owned(self.store_fused, msg, null_data, ssvep_data, settings)
+            self.STATE.refresh_stats.set()
+            return
+
+        self.STATE.sample_times.append(msg.trigger.timestamp)
+        null_axis = replace(axis, offset = axis.units(t0_idx - n_samp))
+        ssvep_axis = replace(axis, offset = axis.units(t0_idx))
+        yield self.OUTPUT_NULL_SIGNAL, replace(msg.sample, data = null_data, axes = {**msg.sample.axes, time_axis: null_axis})
+        yield self.OUTPUT_SSVEP_SIGNAL, replace(msg.sample, data = ssvep_data, axes = {**msg.sample.axes, time_axis: ssvep_axis})
+
+    def store_fused(
+        self,
+        msg: SampleMessage,
+        null_data: npt.NDArray,
+        ssvep_data: npt.NDArray,
+        settings: SpectralStatsSettings
+    ) -> None:
+        """ Spectra of both epoch halves in one rfft, stored as a pair """
+        time_axis = settings.time_axis
+        axis = msg.sample.get_axis(time_axis)
+        axis_idx = msg.sample.get_axis_idx(time_axis)
+        spectra = epoch_spectrum_db(np.stack((null_data, ssvep_data)), axis_idx + 1, axis.gain, settings)
+        freq_axis = settings.freq_axis
+        dims = [freq_axis if dim == time_axis else dim for dim in msg.sample.dims]
+        axes = {name: ax for name, ax in msg.sample.axes.items() if name != time_axis}
+        axes[freq_axis] = positive_freq_axis(null_data.shape[axis_idx], axis.gain)
+        self.store_spectra(
+            replace(msg.sample, data = spectra[0], dims = dims, axes = axes),
+            replace(msg.sample, data = spectra[1], dims = dims, axes = axes),
+            msg.trigger.timestamp
+        )
 
     @ez.subscriber(INPUT_NULL_SPECTRUM)
     async def on_null_spectrum(self, msg: AxisArray) -> None:
@@ -105,10 +261,70 @@ class SpectralStatsCalc(ez.Unit):
     @ez.subscriber(INPUT_RESET)
     async def on_reset(self, msg: ez.Flag) -> None:
         ez.logger.info( 'Resetting Spectral Statistics' )
-        self.STATE.spectra_null.clear()
-        self.STATE.spectra_ssvep.clear()
+        await self.run_owned(self.reset_stats)
         self.STATE.refresh_stats.set()
 
+    def reset_stats(self) -> None:
+        self.STATE.trial_times.clear()
+        self.STATE.spectrum_layout = None
+        self.STATE.freq_idx = None
+        self.STATE.stats_template = None
+        self.STATE.mwu.reset()
+        self.STATE.stats_version += 1
+
+    def store_spectra(self, null: AxisArray, ssvep: AxisArray, timestamp: float) -> None:
+        """ Add a null/SSVEP spectrum pair to the running statistics.
+        The freq_range selection is resolved to an index slice from the
+        first spectrum, and only those bins are copied into the store.
+        Trials beyond max_trials or older than max_age are then evicted.
+        Spectra stacked along trial_axis are stored one trial at a time.
+        """
+        trial_axis = self.SETTINGS.trial_axis
+        if trial_axis is not None and trial_axis in ssvep.dims:
+            trial_idx = ssvep.get_axis_idx(trial_axis)
+            dims = [dim for dim in ssvep.dims if dim != trial_axis]
+            axes = {name: ax for name, ax in ssvep.axes.items() if name != trial_axis}
+            for trial in range(ssvep.shape[trial_idx]):
+                self.store_spectra(
+                    replace(null, data = slice_along_axis(null.data, trial, trial_idx), dims = dims, axes = axes),
+                    replace(ssvep, data = slice_along_axis(ssvep.data, trial, trial_idx), dims = dims, axes = axes),
+                    timestamp
+                )
+            return
+
+        freq_axis = self.SETTINGS.freq_axis
+        layout = (ssvep.dims, ssvep.shape, ssvep.get_axis(freq_axis))
+        if self.STATE.spectrum_layout is not None and layout != self.STATE.spectrum_layout:
+            ez.logger.warning('Spectrum layout changed; resetting spectral statistics')
+            self.reset_stats()
+
+        if self.STATE.freq_idx is None:
+            self.STATE.spectrum_layout = layout
+            self.STATE.freq_idx = freq_index(ssvep, freq_axis, self.SETTINGS.freq_range)
+            self.STATE.stats_template = ssvep.isel(**{freq_axis: self.STATE.freq_idx})
+
+        # Evict before adding so a bounded store never reallocates
+        max_trials = self.SETTINGS.max_trials
+        while max_trials is not None and self.STATE.mwu.n >= max(max_trials, 1):
+            self.evict_oldest()
+
+        axis_idx = ssvep.get_axis_idx(freq_axis)
+        self.STATE.mwu.add(
+            slice_along_axis(ssvep.data, self.STATE.freq_idx, axis_idx),
+            slice_along_axis(null.data, self.STATE.freq_idx, axis_idx)
+        )
+        self.STATE.trial_times.append(timestamp)
+
+        max_age = self.SETTINGS.max_age
+        while max_age is not None and timestamp - self.STATE.trial_times[0] > max_age:
+            self.evict_oldest()
+
+        self.STATE.stats_version += 1
+
+    def evict_oldest(self) -> None:
+        self.STATE.mwu.popleft()
+        self.STATE.trial_times.popleft()
+
     @ez.subscriber(INPUT_REFRESH)
     async def on_refresh(self, msg: ez.Flag) -> None:
         ez.logger.info('Forcing refresh of stats')
@@ -118,27 +334,129 @@ class SpectralStatsCalc(ez.Unit):
     async def synchronize_spectra(self) -> typing.AsyncGenerator:
         """ Get incoming null and SSVEP spectra and update statistics """
         while True:
-            self.STATE.spectra_null.append(await self.STATE.spect_null_queue.get())
-            self.STATE.spectra_ssvep.append(await self.STATE.spect_ssvep_queue.get())
+            null = await self.STATE.spect_null_queue.get()
+            ssvep = await self.STATE.spect_ssvep_queue.get()
+            # Spectra arrive in the order their samples were split
+            timestamp = self.STATE.sample_times.popleft() if self.STATE.sample_times else time.time()
+
+            # Rank statistics are accumulated as each pair arrives so that
+            # a refresh never has to revisit the whole history
+            await self.run_owned(self.store_spectra, null, ssvep, timestamp)
             self.STATE.refresh_stats.set()
 
     @ez.publisher(OUTPUT_STATS)
     async def update_stats(self) -> typing.AsyncGenerator:
         while True:
             await self.STATE.refresh_stats.wait()
+
+            # Hold off until the next publish slot; refreshes in the meantime merge into this one
+            if self.SETTINGS.max_publish_rate is not None:
+                next_publish = self.STATE.last_publish + (1.0 / self.SETTINGS.max_publish_rate)
+                delay = next_publish - time.monotonic()
+                if delay > 0.0:
+                    await asyncio.sleep(delay)
+
             self.STATE.refresh_stats.clear()
-            if len(self.STATE.spectra_null) < 2 or len(self.STATE.spectra_ssvep) < 2:
-                yield self.OUTPUT_STATS, None
+            version, template, job = await self.run_owned(self.stats_job)
+            if self.SETTINGS.publish_on_change and version == self.STATE.published_version:
                 continue
 
-            ssvep = np.array([spect.sel(**{self.SETTINGS.freq_axis: self.SETTINGS.freq_range}).data for spect in self.STATE.spectra_ssvep])
-            null = np.array([spect.sel(**{self.SETTINGS.freq_axis: self.SETTINGS.freq_range}).data for spect in self.STATE.spectra_null])
-
-            stats = scipy.stats.mannwhitneyu(ssvep, null, alternative = 'two-sided')
-            correction = np.prod(ssvep.shape[1:]) if self.SETTINGS.multiple_comparisons else 1.0
-            inv_log10_p = -np.log10(stats.pvalue * correction)
+            if template is None or job is None:
+                self.STATE.published_version = version
+                self.STATE.last_publish = time.monotonic()
+                yield self.OUTPUT_STATS, None
+                continue
 
-            yield self.OUTPUT_STATS, replace(self.STATE.spectra_ssvep[-1], data = inv_log10_p)
+            if self.STATE.executor is None:
+                inv_log10_p = job()
+            else:
+                # Refreshes arriving while this job runs coalesce into one follow-up job.
+                # Under sustained input one is always pending, so a stale result is
+                # only dropped if the previous one was published.
+                loop = asyncio.get_running_loop()
+                inv_log10_p = await loop.run_in_executor(self.STATE.executor, job)
+                stale = self.SETTINGS.drop_stale_stats and self.STATE.refresh_stats.is_set()
+                if stale and not self.STATE.dropped_stats:
+                    self.STATE.dropped_stats = True
+                    continue
+
+            self.STATE.dropped_stats = False
+            self.STATE.published_version = version
+            self.STATE.last_publish = time.monotonic()
+            yield self.OUTPUT_STATS, replace(template, data = inv_log10_p)
+
+
+    def stats_job(self) -> typing.Tuple[int, typing.Optional[AxisArray], typing.Optional[typing.Callable[[], npt.NDArray]]]:
+        """ Current version, output template and a self-contained p-value job;
+        the job snapshots the store so it can keep changing while the job runs.
+        Template and job are None with fewer than two trials.
+        """
+        version = self.STATE.stats_version
+        template = self.STATE.stats_template
+        if self.STATE.mwu.n < 2 or template is None:
+            return version, None, None
+
+        if self.SETTINGS.stats_test == StatsTest.MANN_WHITNEY:
+            job = partial(
+                compute_stats, 
+                self.STATE.mwu.snapshot(), 
+                self.SETTINGS.multiple_comparisons
+            )
+        else:
+            job = partial(
+                compute_permutation_stats,
+                np.array(self.STATE.mwu.x, dtype = float) - self.STATE.mwu.y,
+                template.get_axis_idx(self.SETTINGS.freq_axis),
+                self.SETTINGS
+            )
+        return version, template, job
+
+
+def epoch_spectrum_db(data: npt.NDArray, axis: int, gain: float, settings: SpectralStatsSettings) -> npt.NDArray:
+    """ Spectra of epoch halves along axis with the configured estimator """
+    return spectrum_db(
+        data, axis, gain,
+        estimator = settings.estimator,
+        welch_segment = settings.welch_segment,
+        welch_overlap = settings.welch_overlap,
+        taper_nw = settings.taper_nw,
+        n_tapers = settings.n_tapers
+    )
+
+
+def compute_stats(snapshot: MannWhitneySnapshot, multiple_comparisons: bool) -> npt.NDArray:
+    """ -log10(p) for every bin, Bonferroni corrected across bins if requested """
+    pvalue = snapshot.pvalue()
+    correction = np.prod(pvalue.shape) if multiple_comparisons else 1.0
+    return -np.log10(pvalue * correction)
+
+
+def stats_axis_label(settings: SpectralStatsSettings) -> str:
+    """ Plot label naming the correction behind the -log10(p) values """
+    if settings.stats_test == StatsTest.PERMUTATION_MAX:
+        correction = 'Max-t Permutation'
+    elif settings.stats_test == StatsTest.PERMUTATION_CLUSTER:
+        correction = 'Cluster-Mass Permutation'
+    elif settings.multiple_comparisons:
+        correction = 'Bonferroni Corrected'
+    else:
+        correction = 'Uncorrected'
+    return r'\[-\log_{10}(p)\text{ -- ' + correction + r' }\]'
+
+
+def compute_permutation_stats(diff: npt.NDArray, freq_idx: int, settings: SpectralStatsSettings) -> npt.NDArray:
+    """ -log10(p) for every bin from a sign-flip permutation test of (trial x ...) paired differences """
+    kwargs = dict(
+        n_permutations = settings.n_permutations,
+        chunk_size = settings.permutation_chunk,
+        workers = settings.permutation_workers,
+        seed = settings.permutation_seed
+    )
+    if settings.stats_test == StatsTest.PERMUTATION_CLUSTER:
+        pvalue = cluster_pvalue(diff, settings.cluster_threshold, freq_idx, **kwargs)
+    else:
+        pvalue = max_t_pvalue(diff, **kwargs)
+    return -np.log10(pvalue)
 
 
 class SpectralStatsControlsSettings(ez.Settings):
@@ -258,7 +576,7 @@ class SpectralStatsPanel(ez.Collection):
                 x_axis = 'freq', 
                 x_axis_scale = AxisScale.LOG,
                 x_axis_label = 'Frequency (Hz)',
-                y_axis_label = r'\[-\log_{10}(p)\text{ -- Bonferroni Corrected }\]'
+                y_axis_label = stats_axis_label(self.SETTINGS)
             )
         )
 
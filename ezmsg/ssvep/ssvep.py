@@ -1,3 +1,5 @@
+import enum
+import time
 import random
 import asyncio
 
@@ -9,18 +11,54 @@ from bokeh.models.formatters import FuncTickFormatter
 
 from param.parameterized import Event
 
-from .stimulus import RadialCheckerboard, Fixation
+from .stimulus import (
+    RadialCheckerboard, 
+    Fixation, 
+    StimulusGrid, 
+    StimulusBank, 
+    set_cache_dir
+)
 
 from typing import Optional, AsyncGenerator, List, Tuple
 
+async def sleep_until(deadline: float) -> float:
+    """ Sleep until a time.monotonic() deadline; returns how late we woke in seconds """
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0.0:
+            return -remaining
+        await asyncio.sleep(remaining)
+
+
+def timing_summary(lateness: List[float]) -> str:
+    late_ms = [1000.0 * late for late in lateness]
+    if not late_ms:
+        return 'no events'
+    mean = sum(late_ms) / len(late_ms)
+    return f'mean {mean:.2f} ms, max {max(late_ms):.2f} ms, last {late_ms[-1]:.2f} ms over {len(late_ms)} events'
+
+
+class DisplayMode(enum.Enum):
+    REPLACE = "Replace Pane Contents" # resend the image on every switch
+    TOGGLE = "Toggle Visibility" # send each image once, then only flip visibility
+
+
 class SSVEPStimSettings(ez.Settings):
     size: int = 600 # px
+    display_mode: DisplayMode = DisplayMode.REPLACE
+    stim_cache_dir: Optional[str] = None # on-disk cache of rendered stimuli
+
+    # Stimuli rendered in parallel at startup for instant switching
+    stim_bank: Optional[StimulusGrid] = None
+    stim_bank_workers: Optional[int] = None
 
 
 class SSVEPStimState(ez.State):
     fixation: Fixation
     stim: Optional[RadialCheckerboard]
+    bank: StimulusBank
     stim_pane: panel.pane.HTML
+    fixation_pane: Optional[panel.pane.HTML] # only created in DisplayMode.TOGGLE
 
     # Stim Design
     period: panel.widgets.FloatSlider
@@ -47,6 +85,17 @@ class SSVEPStim(ez.Unit):
 
     def initialize(self) -> None:
 
+        if self.SETTINGS.stim_cache_dir is not None:
+            set_cache_dir(self.SETTINGS.stim_cache_dir)
+
+        self.STATE.bank = StimulusBank()
+        if self.SETTINGS.stim_bank is not None:
+            self.STATE.bank = StimulusBank.render(
+                self.SETTINGS.stim_bank, 
+                self.SETTINGS.stim_bank_workers
+            )
+            ez.logger.info(f'Pre-rendered {len(self.STATE.bank)} stimuli')
+
         self.STATE.period = panel.widgets.FloatSlider(
             name = 'Reversal Frequency',
             value = 0.1,
@@ -89,6 +138,16 @@ class SSVEPStim(ez.Unit):
             width = self.SETTINGS.size, 
             height = self.SETTINGS.size
         )
+        self.STATE.fixation_pane = None
+        if self.SETTINGS.display_mode == DisplayMode.TOGGLE:
+            self.STATE.fixation_pane = panel.pane.HTML(
+                self.STATE.fixation, 
+                width = self.SETTINGS.size, 
+                height = self.SETTINGS.size,
+                visible = False
+            )
+            self.STATE.stim_pane.object = self.STATE.stim
+            self.show_fixation()
 
         self.STATE.design_btn = panel.widgets.Button(
             name = 'Design Stimulus'
@@ -96,7 +155,9 @@ class SSVEPStim(ez.Unit):
 
         def on_design_stimulus(*events: Event) -> None:
             self.design_stimulus()
-            self.STATE.stim_pane.object = self.STATE.stim
+            if self.SETTINGS.display_mode == DisplayMode.TOGGLE:
+                self.STATE.stim_pane.object = self.STATE.stim
+            self.show_stimulus()
 
         self.STATE.design_btn.param.watch(on_design_stimulus, 'value')
 
@@ -169,41 +230,81 @@ class SSVEPStim(ez.Unit):
                 isi_range: Tuple[float, float] = self.STATE.isi_range.value # type: ignore
                 stim_freq = 1.0 / self.STATE.period.value # type: ignore
 
+                # The whole schedule is laid out up front as absolute monotonic
+                # deadlines so that a late wake-up never pushes later trials back
+                start = time.monotonic()
+                onsets = []
+                next_onset = start + 5.0 + trial_dur
+                for trial in range(n_trials):
+                    onsets.append(next_onset)
+                    next_onset += 2.0 * trial_dur + random.uniform(*isi_range)
+
+                onset_lateness: List[float] = []
+                offset_lateness: List[float] = []
+
                 # Pre-Trial Period
-                self.STATE.stim_pane.object = self.STATE.fixation
+                self.show_fixation()
                 self.STATE.progress.max = n_trials
                 self.STATE.progress.value = 0
-                await asyncio.sleep(5.0)
 
                 # Start Task
 
-                for trial in range(n_trials):
-                    # Baseline
-                    await asyncio.sleep(trial_dur)
+                for trial, onset in enumerate(onsets):
+                    # Baseline (includes the pre-trial period and ISI)
+                    await sleep_until(onset)
 
                     # Stim
-                    self.STATE.stim_pane.object = self.STATE.stim
+                    self.show_stimulus()
+                    onset_time = time.time()
+                    onset_lateness.append(time.monotonic() - onset)
                     yield self.OUTPUT_TRIGGER, SampleTriggerMessage(
+                        timestamp = onset_time,
                         period = (-trial_dur, trial_dur),
                         value = stim_freq
                     )
 
-                    await asyncio.sleep(trial_dur)
+                    offset = onset + trial_dur
+                    await sleep_until(offset)
 
                     # ISI
-                    self.STATE.stim_pane.object = self.STATE.fixation
+                    self.show_fixation()
+                    offset_lateness.append(time.monotonic() - offset)
                     self.STATE.progress.value = trial + 1
-                    isi_per = random.uniform(*isi_range)
-                    await asyncio.sleep(isi_per)
+                    ez.logger.debug(
+                        f'Trial {trial}: onset {1000.0 * onset_lateness[-1]:.2f} ms late, '
+                        f'offset {1000.0 * offset_lateness[-1]:.2f} ms late'
+                    )
+
+                # Let the final ISI play out as before
+                end = next_onset - trial_dur
+                await sleep_until(end)
+
+                ez.logger.info(f'Stimulus onset lateness: {timing_summary(onset_lateness)}')
+                ez.logger.info(f'Stimulus offset lateness: {timing_summary(offset_lateness)}')
+                ez.logger.info(f'Schedule drift at end of run: {1000.0 * (time.monotonic() - end):.2f} ms')
 
             finally:
                 for control in self.controls:
                     control.disabled = False
 
 
+    def show_fixation(self) -> None:
+        if self.STATE.fixation_pane is not None:
+            self.STATE.stim_pane.visible = False
+            self.STATE.fixation_pane.visible = True
+        else:
+            self.STATE.stim_pane.object = self.STATE.fixation
+
+    def show_stimulus(self) -> None:
+        if self.STATE.fixation_pane is not None:
+            self.STATE.fixation_pane.visible = False
+            self.STATE.stim_pane.visible = True
+        else:
+            self.STATE.stim_pane.object = self.STATE.stim
+
     def design_stimulus(self) -> None:
 
-        self.STATE.stim = RadialCheckerboard(
+        params = dict(
             duration = self.STATE.period.value, # type: ignore
             radial_freq = self.STATE.radial_freq.value, # type: ignore
             radial_exp = self.STATE.radial_exp.value, # type: ignore
@@ -211,7 +312,20 @@ class SSVEPStim(ez.Unit):
             size = self.SETTINGS.size
         )
 
+        stim = self.STATE.bank.get(RadialCheckerboard, **params)
+        self.STATE.stim = stim if stim is not None else RadialCheckerboard(**params) # type: ignore
+
     def panel(self) -> panel.viewable.Viewable:
+        display = self.STATE.stim_pane
+        if self.STATE.fixation_pane is not None:
+            # Both panes share one slot; only one of them is visible at a time
+            display = panel.Column(
+                self.STATE.fixation_pane,
+                self.STATE.stim_pane,
+                width = self.SETTINGS.size,
+                height = self.SETTINGS.size,
+            )
+
         return panel.Row(
             panel.Column(
                 '__Design Stimulus__',
@@ -227,6 +341,6 @@ class SSVEPStim(ez.Unit):
                 self.STATE.start_btn,
                 self.STATE.progress,
             ),
-            self.STATE.stim_pane,
+            display,
         )
         
\ No newline at end of file
@@ -1,12 +1,50 @@
+import os
 import base64
+import hashlib
+import functools
+import itertools
 
-from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+
+from dataclasses import dataclass, field, fields
 
 import imageio
 import numpy as np
 import numpy.typing as npt
 
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+# Version of the rendered output; bump to invalidate on-disk caches
+_CACHE_VERSION = 1
+_cache_dir: Optional[str] = os.environ.get('EZMSG_SSVEP_STIM_CACHE')
+
+# Data URIs rendered ahead of time by StimulusBank, by cache_key
+_prerendered: Dict[str, str] = {}
+
+def set_cache_dir(path: Optional[str]) -> None:
+    """ Directory for the content-addressed GIF cache shared across runs; None disables it """
+    global _cache_dir
+    _cache_dir = path
+
+@functools.lru_cache(maxsize = 8)
+def cartesian_grid(size: int) -> Tuple[npt.NDArray, npt.NDArray]:
+    """ Read-only normalized (x, y) pixel coordinates in [-1, 1) for a size x size image """
+    half = size / 2.0
+    px = (np.arange(size) - half) / half
+    x, y = np.meshgrid(px, px)
+    x.flags.writeable = False
+    y.flags.writeable = False
+    return x, y
+
+@functools.lru_cache(maxsize = 8)
+def polar_grid(size: int) -> Tuple[npt.NDArray, npt.NDArray]:
+    """ Read-only (radius, angle) of the cartesian_grid pixels """
+    x, y = cartesian_grid(size)
+    dist = np.sqrt(x**2 + y**2)
+    angle = np.arctan2(y, x)
+    dist.flags.writeable = False
+    angle.flags.writeable = False
+    return dist, angle
 
 @dataclass(frozen = True)
 class GIFStimulus:
@@ -18,26 +56,30 @@ class GIFStimulus:
 
     duration: float = 0.08 # frame duration
     size: int = 600 # px
-    _src: str = field(init = False)
+    _src: str = field(init = False, repr = False, compare = False)
 
     def __post_init__(self) -> None:
-        stim_bytes = imageio.mimwrite(
+        # Working around frozen dataclass for image caching
+        src = _prerendered.get(self.cache_key()) if _prerendered else None
+        object.__setattr__(self, '_src', src if src is not None else render_src(self))
+
+    def encode(self) -> bytes:
+        """ Render and encode the GIF; prefer the cached `render_src` """
+        return imageio.mimwrite(
             '<bytes>',
             ims = self.images(), 
             format = 'gif', # type: ignore
             duration = self.duration
         )
 
-        stim_b64 = base64.b64encode(stim_bytes).decode("ascii")
-
-        # Working around frozen dataclass for image caching
-        object.__setattr__(self, '_src', f'data:image/gif;base64,{stim_b64}')
+    def cache_key(self) -> str:
+        """ Content address of this stimulus; hashes the class and its parameters """
+        params = [(f.name, getattr(self, f.name)) for f in fields(self) if f.init]
+        ident = f'{_CACHE_VERSION}:{type(self).__module__}.{type(self).__qualname__}:{params!r}'
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
     
     def images(self) -> List[npt.NDArray[np.uint8]]:
-        half = self.size / 2.0
-        px = (np.arange(self.size) - half) / half
-        x, y = np.meshgrid(px, px)
-        return self.design(x, y)
+        return self.design(*cartesian_grid(self.size))
 
     def design(self, x: npt.NDArray, y: npt.NDArray) -> List[npt.NDArray[np.uint8]]:
         raise NotImplementedError
@@ -53,8 +95,8 @@ class RadialCheckerboard(GIFStimulus):
     radial_exp: float = 0.5 # warp factor for checker length to center
 
     def design(self, x: npt.NDArray, y: npt.NDArray) -> List[npt.NDArray[np.uint8]]:
-        dist = np.sqrt(x**2 + y**2) ** self.radial_exp
-        angle = np.arctan2(y,x)
+        dist, angle = polar_grid(self.size)
+        dist = dist ** self.radial_exp
         image = np.sin(2 * np.pi * (self.radial_freq / 2.0) * dist)
         image *= np.cos(angle * self.angular_freq / 2.0)
         image = np.sign(image)
@@ -71,9 +113,103 @@ class Fixation(GIFStimulus):
 
     def design(self, x: npt.NDArray, y: npt.NDArray) -> List[npt.NDArray[np.uint8]]:
         image = np.ones_like(x) * 2**7
-        dist = np.sqrt(x**2 + y**2)
+        dist, _ = polar_grid(self.size)
         image[np.where(dist < self.radius)] = 0
         return [image.astype(np.uint8)]
 
 
+@functools.lru_cache(maxsize = 32)
+def render_src(stim: GIFStimulus) -> str:
+    """
+    base64 data URI for a stimulus, memoized on its parameters and, when a
+    cache directory is set, stored on disk so it survives restarts
+    """
+    path = None
+    if _cache_dir is not None:
+        path = os.path.join(_cache_dir, f'{stim.cache_key()}.gif')
+
+    if path is not None and os.path.exists(path):
+        with open(path, 'rb') as f:
+            stim_bytes = f.read()
+    else:
+        stim_bytes = stim.encode()
+        if path is not None:
+            os.makedirs(_cache_dir, exist_ok = True) # type: ignore
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(stim_bytes)
+            os.replace(tmp_path, path)
+
+    stim_b64 = base64.b64encode(stim_bytes).decode("ascii")
+    return f'data:image/gif;base64,{stim_b64}'
+
+
+@dataclass(frozen = True)
+class StimulusGrid:
+    """ Parameter grid of RadialCheckerboards; every combination gets rendered """
+    durations: Tuple[float, ...] = (0.08,)
+    radial_freqs: Tuple[float, ...] = (10.0,)
+    angular_freqs: Tuple[float, ...] = (40.0,)
+    radial_exps: Tuple[float, ...] = (0.5,)
+    sizes: Tuple[int, ...] = (600,)
+
+    def params(self) -> List[Dict[str, Any]]:
+        return [
+            dict(duration = d, radial_freq = r, angular_freq = a, radial_exp = e, size = s)
+            for d, r, a, e, s in itertools.product(
+                self.durations, 
+                self.radial_freqs, 
+                self.angular_freqs, 
+                self.radial_exps, 
+                self.sizes
+            )
+        ]
+
+
+def _prerender(stim_type: Type[GIFStimulus], params: Dict[str, Any], cache_dir: Optional[str]) -> Tuple[str, str]:
+    set_cache_dir(cache_dir)
+    stim = stim_type(**params)
+    return stim.cache_key(), stim._src
+
+
+class StimulusBank:
+    """
+    Rendered stimuli indexed by their parameters.
+    Float parameters are matched to 6 decimal places so slider values find
+    their grid entries.
+    """
 
+    def __init__(self, stims: Iterable[GIFStimulus] = ()) -> None:
+        self._stims: Dict[Tuple, GIFStimulus] = {}
+        for stim in stims:
+            self.add(stim)
+
+    @staticmethod
+    def key(stim_type: Type[GIFStimulus], **params: Any) -> Tuple:
+        values = [params.get(f.name, f.default) for f in fields(stim_type) if f.init]
+        return (stim_type,) + tuple(round(v, 6) if isinstance(v, float) else v for v in values)
+
+    def add(self, stim: GIFStimulus) -> None:
+        params = {f.name: getattr(stim, f.name) for f in fields(stim) if f.init}
+        self._stims[self.key(type(stim), **params)] = stim
+
+    def get(self, stim_type: Type[GIFStimulus] = RadialCheckerboard, **params: Any) -> Optional[GIFStimulus]:
+        return self._stims.get(self.key(stim_type, **params))
+
+    def __len__(self) -> int:
+        return len(self._stims)
+
+    @classmethod
+    def render(cls, grid: StimulusGrid, max_workers: Optional[int] = None) -> 'StimulusBank':
+        """ Render and encode every stimulus in grid across a process pool """
+        params = grid.params()
+        with ProcessPoolExecutor(max_workers = max_workers) as pool:
+            rendered = list(pool.map(
+                _prerender, 
+                itertools.repeat(RadialCheckerboard), 
+                params, 
+                itertools.repeat(_cache_dir)
+            ))
+
+        _prerendered.update(rendered)
+        return cls(RadialCheckerboard(**p) for p in params)
@@ -0,0 +1,125 @@
+import functools
+import typing
+
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+import scipy.linalg
+
+
+def trca_filters(epochs: npt.NDArray, n_components: int = 1, ridge: float = 1e-9) -> npt.NDArray:
+    """
+    Task-related component analysis spatial filters (channel x n_components) for
+    (trial x time x channel) epochs of a single class.
+
+    Maximizes the summed covariance between every pair of distinct trials,
+    S = sum_{i != j} X_i^T X_j = U^T U - sum_i X_i^T X_i with U = sum_i X_i,
+    relative to the pooled covariance Q = sum_i X_i^T X_i.
+    """
+    centered = epochs - epochs.mean(axis = 1, keepdims = True)
+    total = centered.sum(axis = 0)
+    q = np.einsum('itc,itd->cd', centered, centered)
+    s = total.T @ total - q
+    q = q + ridge * np.trace(q) / len(q) * np.eye(len(q))
+    _, vecs = scipy.linalg.eigh(s, q)
+    return vecs[:, ::-1][:, :n_components]
+
+
+@dataclass
+class TrcaModel:
+    """
+    Calibrated (ensemble) TRCA decoder.
+
+    labels: (class,) trigger value of each class
+    templates: (class x time x channel) averaged calibration epochs
+    filters: (class x channel x component) TRCA spatial filters per class
+    fs: sampling rate of the calibration data
+    """
+    labels: npt.NDArray
+    templates: npt.NDArray
+    filters: npt.NDArray
+    fs: float
+
+    @functools.cached_property
+    def filter_matrix(self) -> npt.NDArray:
+        """ Every class's filters side by side (channel x class * component) """
+        n_class, n_ch, n_comp = self.filters.shape
+        return np.moveaxis(self.filters, 0, 1).reshape(n_ch, n_class * n_comp)
+
+    @functools.cached_property
+    def projected_templates(self) -> npt.NDArray:
+        """ Templates through the filter matrix (class x time x class * component) """
+        return self.templates @ self.filter_matrix
+
+    @functools.cached_property
+    def class_mask(self) -> npt.NDArray:
+        """ (class x class * component) selector of each class's own filters """
+        n_class, _, n_comp = self.filters.shape
+        return np.repeat(np.eye(n_class), n_comp, axis = 1)
+
+    def score(self, windows: npt.NDArray, ensemble: bool = True) -> npt.NDArray:
+        """
+        Correlation of (... x time x channel) windows with each class template,
+        shape (... x class).  Windows are aligned to stimulus onset and may be
+        shorter than the calibration epochs.  All classes are scored from one
+        projection through `filter_matrix`; plain TRCA compares each class on
+        its own filters, ensemble TRCA on all of them.
+        """
+        n_time = windows.shape[-2]
+        if n_time > self.templates.shape[1]:
+            raise ValueError(f'Window of {n_time} samples exceeds the {self.templates.shape[1]} sample templates')
+
+        proj = windows @ self.filter_matrix
+        proj = proj - proj.mean(axis = -2, keepdims = True)
+        tmpl = self.projected_templates[:, :n_time]
+        tmpl = tmpl - tmpl.mean(axis = -2, keepdims = True)
+
+        mask = np.ones_like(self.class_mask) if ensemble else self.class_mask
+        tmpl = tmpl * mask[:, None, :]
+        num = np.einsum('...tm,ktm->...k', proj, tmpl)
+        den = np.sqrt(np.einsum('...tm,km->...k', proj ** 2, mask) * np.sum(tmpl ** 2, axis = (-2, -1)))
+        return num / den
+
+    def classify(self, windows: npt.NDArray, ensemble: bool = True) -> npt.NDArray:
+        """ Label of the best scoring class for each window """
+        return self.labels[np.argmax(self.score(windows, ensemble), axis = -1)]
+
+    def save(self, path: str) -> None:
+        """ Write to exactly `path`; numpy would append .npz to a bare filename """
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                labels = self.labels,
+                templates = self.templates,
+                filters = self.filters,
+                fs = self.fs
+            )
+
+    @classmethod
+    def load(cls, path: str) -> 'TrcaModel':
+        with np.load(path) as npz:
+            return cls(
+                labels = npz['labels'],
+                templates = npz['templates'],
+                filters = npz['filters'],
+                fs = float(npz['fs'])
+            )
+
+
+def fit_trca(
+    epochs: npt.NDArray,
+    labels: typing.Sequence[typing.Any],
+    fs: float,
+    n_components: int = 1
+) -> TrcaModel:
+    """ Fit a TrcaModel to onset-aligned (trial x time x channel) epochs """
+    labels = np.asarray(labels)
+    classes = np.unique(labels)
+    for label in classes:
+        if np.count_nonzero(labels == label) < 2:
+            raise ValueError(f'TRCA needs at least two epochs of class {label}')
+
+    templates = np.stack([epochs[labels == label].mean(axis = 0) for label in classes])
+    filters = np.stack([trca_filters(epochs[labels == label], n_components) for label in classes])
+    return TrcaModel(classes, templates, filters, fs)
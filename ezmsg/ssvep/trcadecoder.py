@@ -0,0 +1,121 @@
+import os
+import typing
+
+import ezmsg.core as ez
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage
+
+from .trca import TrcaModel, fit_trca
+from .epochs import onset_index
+from .spectralccaextractor import TransformOutput
+
+
+class TrcaDecoderSettings(ez.Settings):
+    # Fitted model; loaded at startup if it exists and (re)written after calibration
+    model_path: typing.Optional[str] = None
+    ensemble: bool = True
+    n_components: int = 1
+    timedim: str = 'time'
+
+    # Seconds of each calibration epoch, from the trigger onset, used for the
+    # templates.  Decoded windows must be no longer; None uses all post-onset data.
+    epoch_dur: typing.Optional[float] = None
+
+
+class TrcaDecoderState(ez.State):
+    model: typing.Optional[TrcaModel] = None
+    epochs: typing.List[np.ndarray]
+    labels: typing.List[typing.Any]
+    fs: typing.Optional[float] = None
+
+
+class TrcaDecoder(ez.Unit):
+    """
+    Calibration-based (ensemble) TRCA decoder.
+
+    Calibration epochs arrive on INPUT_SAMPLE from the Sampler, labeled by their
+    trigger value; a flag on INPUT_FIT fits the model and saves it to
+    `model_path`.  Onset-aligned windows on INPUT_SIGNAL are decoded with the
+    current model by a single projection through its stacked filter matrix.
+    """
+    SETTINGS: TrcaDecoderSettings
+    STATE: TrcaDecoderState
+
+    INPUT_SAMPLE = ez.InputStream(SampleMessage)
+    INPUT_FIT = ez.InputStream(ez.Flag)
+    INPUT_SIGNAL = ez.InputStream(AxisArray)
+    OUTPUT_DECODE = ez.OutputStream(TransformOutput)
+
+    def initialize(self) -> None:
+        self.STATE.epochs = []
+        self.STATE.labels = []
+        path = self.SETTINGS.model_path
+        if path is not None and os.path.exists(path):
+            self.STATE.model = TrcaModel.load(path)
+            ez.logger.info(f'Loaded TRCA model for {len(self.STATE.model.labels)} classes from {path}')
+
+    @ez.subscriber(INPUT_SAMPLE)
+    async def on_sample(self, msg: SampleMessage) -> None:
+        timedim = self.SETTINGS.timedim
+        axis = msg.sample.get_axis(timedim)
+        onset = onset_index(msg, timedim)
+        stop = None
+        if self.SETTINGS.epoch_dur is not None:
+            stop = onset + int(round(self.SETTINGS.epoch_dur / axis.gain))
+
+        with msg.sample.view2d(timedim) as data:
+            epoch = data[onset:stop].copy()
+
+        if self.STATE.epochs and epoch.shape != self.STATE.epochs[0].shape:
+            ez.logger.warning(f'Discarding calibration epoch of shape {epoch.shape}; expected {self.STATE.epochs[0].shape}')
+            return
+
+        self.STATE.epochs.append(epoch)
+        self.STATE.labels.append(msg.trigger.value)
+        self.STATE.fs = 1.0 / axis.gain
+
+    @ez.subscriber(INPUT_FIT)
+    async def on_fit(self, msg: ez.Flag) -> None:
+        try:
+            model = fit_trca(
+                np.stack(self.STATE.epochs),
+                self.STATE.labels,
+                self.STATE.fs,
+                n_components = self.SETTINGS.n_components
+            )
+        except ValueError as e:
+            ez.logger.warning(f'Could not fit TRCA model: {e}')
+            return
+
+        self.STATE.model = model
+        if self.SETTINGS.model_path is not None:
+            model.save(self.SETTINGS.model_path)
+        ez.logger.info(f'Fit TRCA model on {len(self.STATE.epochs)} epochs')
+
+    @ez.subscriber(INPUT_SIGNAL)
+    @ez.publisher(OUTPUT_DECODE)
+    async def decode(self, msg: AxisArray) -> typing.AsyncGenerator:
+        model = self.STATE.model
+        if model is None:
+            return
+
+        # The model may come from disk, calibrated on another montage or rate
+        fs = 1.0 / msg.get_axis(self.SETTINGS.timedim).gain
+        if not np.isclose(fs, model.fs):
+            ez.logger.warning(f'Discarding window sampled at {fs} Hz; model was calibrated at {model.fs} Hz')
+            return
+
+        with msg.view2d(self.SETTINGS.timedim) as X:
+            n_time, n_ch = X.shape
+            _, n_template, n_model_ch = model.templates.shape
+            if n_ch != n_model_ch:
+                ez.logger.warning(f'Discarding window with {n_ch} channels; model was calibrated on {n_model_ch}')
+                return
+            if n_time > n_template:
+                ez.logger.warning(f'Discarding window of {n_time} samples; model templates hold {n_template}')
+                return
+            scores = model.score(X, self.SETTINGS.ensemble)
+
+        yield self.OUTPUT_DECODE, TransformOutput(model.labels[np.argmax(scores)], scores)
@@ -0,0 +1,79 @@
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+
+class TrialStore:
+    """
+    Preallocated (trial x ...) ring buffer that grows by doubling.
+
+    Observations are copied into a contiguous block as they arrive and the
+    oldest can be dropped with `popleft` in O(1), so a store that is trimmed
+    as fast as it is filled never reallocates.
+    """
+
+    def __init__(self, shape: typing.Tuple[int, ...], dtype: npt.DTypeLike = np.float64, capacity: int = 64) -> None:
+        self._buffer = np.empty((max(capacity, 1),) + tuple(shape), dtype = dtype)
+        self._head = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def shape(self) -> typing.Tuple[int, ...]:
+        """ Shape of a single observation """
+        return self._buffer.shape[1:]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._buffer.dtype
+
+    @property
+    def capacity(self) -> int:
+        return self._buffer.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.nbytes
+
+    def segments(self) -> typing.Tuple[npt.NDArray, ...]:
+        """ Views covering all stored observations, oldest first; one or two depending on wrap """
+        end = self._head + self._len
+        if end <= self.capacity:
+            return (self._buffer[self._head:end],)
+        return (self._buffer[self._head:], self._buffer[:end - self.capacity])
+
+    @property
+    def data(self) -> npt.NDArray:
+        """ All stored observations, oldest first; a view unless the ring has wrapped """
+        segments = self.segments()
+        return segments[0] if len(segments) == 1 else np.concatenate(segments)
+
+    def __getitem__(self, idx: int) -> npt.NDArray:
+        if not -self._len <= idx < self._len:
+            raise IndexError('TrialStore index out of range')
+        return self._buffer[(self._head + (idx % self._len)) % self.capacity]
+
+    def append(self, obs: npt.ArrayLike) -> None:
+        if self._len == self.capacity:
+            grown = np.empty((2 * self.capacity,) + self.shape, dtype = self.dtype)
+            grown[:self._len] = self.data
+            self._buffer = grown
+            self._head = 0
+        self._buffer[(self._head + self._len) % self.capacity] = obs
+        self._len += 1
+
+    def popleft(self) -> npt.NDArray:
+        """ Remove and return (a copy of) the oldest observation """
+        if self._len == 0:
+            raise IndexError('pop from an empty TrialStore')
+        obs = self._buffer[self._head].copy()
+        self._head = (self._head + 1) % self.capacity
+        self._len -= 1
+        return obs
+
+    def clear(self) -> None:
+        self._head = 0
+        self._len = 0
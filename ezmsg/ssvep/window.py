@@ -0,0 +1,79 @@
+import numpy as np
+import numpy.typing as npt
+
+
+class TrailingWindow:
+    """
+    Ring buffer of the last n_window samples of a (time x channel) stream,
+    for statistics kept as running sums over that window.
+
+    Each update adds the incoming block to the sums and subtracts the samples
+    it evicts, so its cost scales with the block length rather than the window
+    length.  Subclasses hold the sums and implement `_clear` and
+    `_accumulate`; sums are rebuilt exactly from the buffer every
+    `recompute_every` updates to bound floating point drift.
+    """
+
+    def __init__(self, n_window: int, n_channels: int, recompute_every: int = 200) -> None:
+        self.n_window = n_window
+        self.n_channels = n_channels
+        self.recompute_every = recompute_every
+
+        self._buffer = np.zeros((n_window, n_channels))
+        self.reset()
+
+    def reset(self) -> None:
+        self._clear()
+        self._count = 0
+        self._samples = 0 # Total samples seen; index of the next sample
+        self._updates = 0
+
+    @property
+    def n_samples(self) -> int:
+        """ Number of samples currently in the window """
+        return self._count
+
+    @property
+    def full(self) -> bool:
+        return self._count == self.n_window
+
+    def _clear(self) -> None:
+        """ Zero the running sums """
+        raise NotImplementedError
+
+    def _accumulate(self, start: int, block: npt.NDArray, sign: float) -> None:
+        """ Add (sign 1) or remove (sign -1) a block whose first sample is stream index `start` """
+        raise NotImplementedError
+
+    def _recompute(self) -> None:
+        start = self._samples - self._count
+        idx = np.arange(start, self._samples) % self.n_window
+        self._clear()
+        self._accumulate(start, self._buffer[idx], 1.0)
+
+    def update(self, block: npt.NDArray) -> None:
+        """ Push a (time x channel) block of samples """
+        n = block.shape[0]
+        if n >= self.n_window:
+            # Nothing of the old window survives
+            self._samples += n - self.n_window
+            block = block[-self.n_window:]
+            n = self.n_window
+            self._count = 0
+            self._clear()
+
+        n_evict = max(self._count + n - self.n_window, 0)
+        if n_evict:
+            start = self._samples - self._count
+            idx = np.arange(start, start + n_evict) % self.n_window
+            self._accumulate(start, self._buffer[idx], -1.0)
+
+        idx = np.arange(self._samples, self._samples + n) % self.n_window
+        self._buffer[idx] = block
+        self._accumulate(self._samples, block, 1.0)
+        self._samples += n
+        self._count += n - n_evict
+
+        self._updates += 1
+        if self._updates % self.recompute_every == 0:
+            self._recompute()
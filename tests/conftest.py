@@ -0,0 +1,50 @@
+import typing
+import inspect
+
+import numpy as np
+import ezmsg.core as ez
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage, SampleTriggerMessage
+
+from ezmsg.ssvep.spectralstats import SpectralStatsSettings
+
+UnitType = typing.TypeVar('UnitType', bound = ez.Unit)
+
+
+def make_unit(cls: typing.Type[UnitType], settings: ez.Settings) -> UnitType:
+    """ Stand-alone unit whose coroutines can be driven directly, outside ez.run """
+    unit = cls(settings)
+    unit._instantiate_state()
+    if not inspect.iscoroutinefunction(unit.initialize):
+        unit.initialize()
+    return unit
+
+
+async def drain(agen: typing.AsyncGenerator) -> None:
+    async for _ in agen:
+        pass
+
+
+async def collect(agen: typing.AsyncGenerator) -> typing.List[typing.Any]:
+    return [msg async for msg in agen]
+
+
+def stats_settings(**kwargs: typing.Any) -> SpectralStatsSettings:
+    return SpectralStatsSettings(
+        time_axis = 'time',
+        integration_time = 1.0,
+        freq_range = slice(1.0, 40.0),
+        **kwargs
+    )
+
+
+def trial_sample(rng: np.random.Generator, timestamp: float, fs: float = 250.0) -> SampleMessage:
+    """ ('ch', 'time') trial spanning [-1, 1) sec around an onset, with a 10 Hz response after it """
+    t = np.arange(int(2 * fs)) / fs - 1.0
+    data = rng.normal(size = (4, t.size))
+    data[:, t >= 0] += np.sin(2 * np.pi * 10 * t[t >= 0])
+    return SampleMessage(
+        trigger = SampleTriggerMessage(timestamp = timestamp, period = (-1.0, 1.0), value = 10.0),
+        sample = AxisArray(data, dims = ['ch', 'time'], axes = {'time': AxisArray.Axis.TimeAxis(fs, offset = timestamp - 1.0)})
+    )
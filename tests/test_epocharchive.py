@@ -0,0 +1,142 @@
+import json
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage, SampleTriggerMessage
+
+from ezmsg.ssvep.epocharchive import DATA_FILE, INDEX_FILE, TRIALS_FILE, EpochArchive, EpochArchiveWriter
+
+
+def make_sample(trial: int) -> SampleMessage:
+    data = np.full((4, 50), float(trial))
+    return SampleMessage(
+        trigger = SampleTriggerMessage(timestamp = 10.0 * trial, period = (-0.1, 0.1), value = trial),
+        sample = AxisArray(
+            data,
+            dims = ['ch', 'time'],
+            axes = {'time': AxisArray.Axis.TimeAxis(250.0, offset = 10.0 * trial - 0.1)}
+        )
+    )
+
+
+def write(path, trials) -> None:
+    writer = EpochArchiveWriter(path)
+    for trial in trials:
+        writer.append(make_sample(trial))
+    writer.close()
+
+
+def make_version_1(path) -> None:
+    index = json.loads((path / INDEX_FILE).read_text())
+    index['version'] = 1
+    index['trials'] = [json.loads(line) for line in (path / TRIALS_FILE).read_text().splitlines()]
+    (path / INDEX_FILE).write_text(json.dumps(index))
+    (path / TRIALS_FILE).unlink()
+
+
+def test_round_trip_and_reopen(tmp_path) -> None:
+    write(tmp_path, range(3))
+    write(tmp_path, range(3, 5))
+
+    archive = EpochArchive(tmp_path)
+    assert len(archive) == 5
+    assert archive.values == list(range(5))
+    for idx, msg in enumerate(archive.samples()):
+        np.testing.assert_array_equal(msg.sample.data, make_sample(idx).sample.data)
+        assert msg.trigger.timestamp == 10.0 * idx
+        assert msg.sample.get_axis('time').offset == 10.0 * idx - 0.1
+
+
+def test_append_leaves_index_alone(tmp_path) -> None:
+    writer = EpochArchiveWriter(tmp_path)
+    writer.append(make_sample(0))
+    index_mtime = (tmp_path / INDEX_FILE).stat().st_mtime_ns
+    header = (tmp_path / INDEX_FILE).read_text()
+    for trial in range(1, 20):
+        writer.append(make_sample(trial))
+    writer.close()
+    assert (tmp_path / INDEX_FILE).read_text() == header
+    assert (tmp_path / INDEX_FILE).stat().st_mtime_ns == index_mtime
+    assert len((tmp_path / TRIALS_FILE).read_text().splitlines()) == 20
+
+
+def test_reopen_truncates_interrupted_write(tmp_path) -> None:
+    write(tmp_path, range(3))
+    nbytes = make_sample(0).sample.data.nbytes
+
+    # Crash after the data of a fourth trial but before its record
+    with open(tmp_path / DATA_FILE, 'ab') as f:
+        f.write(b'\0' * (nbytes // 2))
+    assert len(EpochArchive(tmp_path)) == 3
+
+    write(tmp_path, [3])
+    assert (tmp_path / DATA_FILE).stat().st_size == 4 * nbytes
+    archive = EpochArchive(tmp_path)
+    assert archive.values == [0, 1, 2, 3]
+    np.testing.assert_array_equal(archive[3].sample.data, make_sample(3).sample.data)
+
+
+def test_partial_record_is_dropped(tmp_path) -> None:
+    write(tmp_path, range(2))
+    with open(tmp_path / TRIALS_FILE, 'a') as f:
+        f.write('{"timestamp": 20.0, "per')
+    assert len(EpochArchive(tmp_path)) == 2
+    write(tmp_path, [2])
+    assert EpochArchive(tmp_path).values == [0, 1, 2]
+
+
+def test_reads_and_extends_version_1(tmp_path) -> None:
+    write(tmp_path, range(2))
+    make_version_1(tmp_path)
+
+    assert EpochArchive(tmp_path).values == [0, 1]
+    write(tmp_path, [2])
+    assert EpochArchive(tmp_path).values == [0, 1, 2]
+    assert 'trials' not in json.loads((tmp_path / INDEX_FILE).read_text())
+
+
+def test_interrupted_migration_keeps_every_trial(tmp_path, monkeypatch) -> None:
+    write(tmp_path, range(3))
+    make_version_1(tmp_path)
+
+    # Crash after the records were rewritten but before the new index was swapped in
+    def crash(self) -> None:
+        raise RuntimeError('crash')
+
+    with monkeypatch.context() as m:
+        m.setattr(EpochArchiveWriter, '_write_index', crash)
+        with pytest.raises(RuntimeError):
+            EpochArchiveWriter(tmp_path)
+    assert EpochArchive(tmp_path).values == [0, 1, 2]
+
+    write(tmp_path, [3])
+    assert EpochArchive(tmp_path).values == [0, 1, 2, 3]
+    np.testing.assert_array_equal(EpochArchive(tmp_path)[2].sample.data, make_sample(2).sample.data)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_interrupted_record_rewrite_keeps_every_trial(tmp_path, monkeypatch, version: int) -> None:
+    write(tmp_path, range(3))
+    if version == 1:
+        make_version_1(tmp_path)
+
+    # Crash part way through writing the records
+    encode = EpochArchiveWriter._encode
+    calls = []
+
+    def crash(trial) -> str:
+        calls.append(trial)
+        if len(calls) > 1:
+            raise RuntimeError('crash')
+        return encode(trial)
+
+    with monkeypatch.context() as m:
+        m.setattr(EpochArchiveWriter, '_encode', staticmethod(crash))
+        with pytest.raises(RuntimeError):
+            EpochArchiveWriter(tmp_path)
+    assert EpochArchive(tmp_path).values == [0, 1, 2]
+
+    write(tmp_path, [3])
+    assert EpochArchive(tmp_path).values == [0, 1, 2, 3]
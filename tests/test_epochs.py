@@ -0,0 +1,33 @@
+import sys
+import subprocess
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage, SampleTriggerMessage
+
+from ezmsg.ssvep.epochs import onset_index, freq_index
+
+
+def test_onset_index() -> None:
+    sample = AxisArray(np.zeros((2, 100)), dims = ['ch', 'time'], axes = {'time': AxisArray.Axis.TimeAxis(100.0, offset = 4.6)})
+    on_clock = SampleTriggerMessage(timestamp = 5.0, period = (-0.4, 0.6))
+    assert onset_index(SampleMessage(trigger = on_clock, sample = sample), 'time') == 40
+    # Trigger on another clock: fall back to the period
+    off_clock = SampleTriggerMessage(timestamp = 100.0, period = (-0.25, 0.75))
+    assert onset_index(SampleMessage(trigger = off_clock, sample = sample), 'time') == 25
+
+
+def test_freq_index() -> None:
+    spect = AxisArray(np.arange(50.0), dims = ['freq'], axes = {'freq': AxisArray.Axis(unit = 'Hz', gain = 0.5, offset = 0.0)})
+    idx = freq_index(spect, 'freq', slice(2.0, 10.0))
+    np.testing.assert_array_equal(spect.data[idx], np.arange(4.0, 20.0))
+    assert freq_index(spect, 'freq', slice(None)) == slice(None, None, None)
+
+
+def test_decoding_modules_skip_ui_imports() -> None:
+    code = (
+        'import sys, ezmsg.ssvep.trcadecoder, ezmsg.ssvep.epochs; '
+        'sys.exit(any(name in sys.modules for name in ("panel", "bokeh")))'
+    )
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
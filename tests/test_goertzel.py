@@ -0,0 +1,65 @@
+import typing
+import asyncio
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from ezmsg.ssvep.goertzel import NarrowbandSnr, NarrowbandSnrSettings, narrowband_snr, noise_mask, snr_frequencies
+
+from conftest import make_unit, collect
+
+FS = 250.0
+
+
+def test_noise_mask_drops_bins_at_or_below_dc() -> None:
+    # 7 Hz with 4 Hz spacing: the lower neighbours reach 3, -1, -5 and -9 Hz
+    freqs = snr_frequencies([7.0], 1, 4, 4.0)
+    mask = noise_mask(freqs, FS)
+    np.testing.assert_array_equal(freqs[0, 0, 1:][mask[0, 0]], [11.0, 15.0, 19.0, 23.0, 3.0])
+
+
+def test_noise_mask_drops_bins_above_nyquist() -> None:
+    freqs = snr_frequencies([60.0], 2, 2, 1.0)
+    mask = noise_mask(freqs, 242.0)
+    np.testing.assert_array_equal(freqs[0, 1, 1:][mask[0, 1]], [119.0, 118.0])
+
+
+def test_noise_mask_rejects_harmonics_past_nyquist() -> None:
+    with pytest.raises(ValueError):
+        noise_mask(snr_frequencies([40.0], 4, 2, 1.0), FS)
+
+
+def test_narrowband_snr_ignores_masked_bins() -> None:
+    power = np.ones((1, 2, 5, 3))
+    power[:, :, 0] = 10.0
+    power[0, 0, 3:] = 1e6 # e.g. the mirror image of the signal bin
+    mask = np.ones((1, 2, 4), dtype = bool)
+    mask[0, 0, 2:] = False
+    np.testing.assert_allclose(narrowband_snr(power, mask), 10.0 * np.log10(20.0 / 2.0))
+    assert np.all(narrowband_snr(power) < 0.0)
+
+
+def stream(freq: float, n_time: int, n_ch: int = 2) -> AxisArray:
+    t = np.arange(n_time) / FS
+    data = np.random.default_rng(0).normal(size = (n_time, n_ch)) + 2.0 * np.sin(2 * np.pi * freq * t)[:, None]
+    return AxisArray(data, dims = ['time', 'ch'], axes = {'time': AxisArray.Axis.TimeAxis(FS)})
+
+
+def run(settings: NarrowbandSnrSettings, msg: AxisArray) -> typing.List[typing.Any]:
+    unit = make_unit(NarrowbandSnr, settings)
+    return asyncio.run(collect(unit.on_signal(msg)))
+
+
+def test_narrowband_snr_unit() -> None:
+    out = run(NarrowbandSnrSettings(freqs = [7.0, 11.0], window_dur = 0.25), stream(7.0, 250))
+    assert len(out) == 1
+    _, snr = out[0]
+    assert snr.dims == ['target', 'ch'] and snr.shape == (2, 2)
+    assert np.all(np.isfinite(snr.data))
+    assert np.all(snr.data[0] > snr.data[1] + 10.0)
+
+
+def test_narrowband_snr_unit_skips_unusable_settings() -> None:
+    assert run(NarrowbandSnrSettings(freqs = [50.0], n_harm = 3), stream(50.0, 500)) == []
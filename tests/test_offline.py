@@ -0,0 +1,61 @@
+import typing
+import asyncio
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage
+
+from ezmsg.ssvep.epocharchive import EpochArchiveWriter
+from ezmsg.ssvep.offline import analyze_directory, analyze_samples, retained_trials
+from ezmsg.ssvep.spectralstats import SpectralStatsCalc, SpectralStatsSettings
+
+from conftest import make_unit, drain, stats_settings, trial_sample
+
+
+def make_settings(**kwargs: typing.Any) -> SpectralStatsSettings:
+    return stats_settings(fused_spectrum = True, **kwargs)
+
+
+async def online_stats(samples: typing.List[SampleMessage], settings: SpectralStatsSettings) -> AxisArray:
+    unit = make_unit(SpectralStatsCalc, settings)
+    for sample in samples:
+        await drain(unit.split_sample(sample))
+    stats = unit.update_stats()
+    unit.STATE.refresh_stats.set()
+    _, result = await stats.__anext__()
+    await stats.aclose()
+    return result
+
+
+def test_retained_trials() -> None:
+    timestamps = [0.0, 1.0, 2.0, 10.0, 11.0, 12.0, 13.0]
+    assert retained_trials(timestamps) == list(range(7))
+    assert retained_trials(timestamps, max_trials = 3) == [4, 5, 6]
+    assert retained_trials(timestamps, max_age = 2.5) == [4, 5, 6]
+    assert retained_trials(timestamps, max_trials = 2, max_age = 5.0) == [5, 6]
+
+
+@pytest.mark.parametrize('bounds', [dict(), dict(max_trials = 4), dict(max_age = 25.0)])
+def test_offline_matches_online_bounds(bounds: typing.Dict[str, typing.Any]) -> None:
+    rng = np.random.default_rng(0)
+    samples = [trial_sample(rng, 10.0 * trial) for trial in range(8)]
+    settings = make_settings(**bounds)
+
+    online = asyncio.run(online_stats(samples, settings))
+    offline = analyze_samples(samples, settings)
+    np.testing.assert_allclose(offline.data, online.data, rtol = 1e-6)
+
+
+def test_analyze_directory_finds_epoch_archives(tmp_path) -> None:
+    rng = np.random.default_rng(1)
+    writer = EpochArchiveWriter(tmp_path / 'session')
+    for trial in range(4):
+        writer.append(trial_sample(rng, 10.0 * trial))
+    writer.close()
+    (tmp_path / 'notes').mkdir()
+
+    results = analyze_directory(tmp_path, make_settings(), pattern = '*', max_workers = 1)
+    assert list(results) == [tmp_path / 'session']
+    assert results[tmp_path / 'session'] is not None
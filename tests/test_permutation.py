@@ -0,0 +1,41 @@
+import numpy as np
+
+from ezmsg.ssvep.permutation import max_t_pvalue, cluster_pvalue, permutation_pvalue
+from ezmsg.ssvep.spectralstats import SpectralStatsSettings, StatsTest, stats_axis_label
+
+
+def extreme_diff(n: int) -> np.ndarray:
+    """ (trial x bin) differences whose first bin is positive in every trial """
+    rng = np.random.default_rng(0)
+    diff = rng.normal(size = (n, 6))
+    diff[:, 0] = 5.0 + rng.uniform(size = n)
+    return diff
+
+
+def test_exact_max_t_has_no_plus_one() -> None:
+    # Only the observed labeling and its mirror image reach the observed max |t|
+    pvalue = max_t_pvalue(extreme_diff(5), n_permutations = 1000)
+    assert pvalue[0] == 2 / 32
+
+
+def test_exact_cluster_has_no_plus_one() -> None:
+    diff = extreme_diff(5)[:, None, :]
+    pvalue = cluster_pvalue(diff, threshold = 2.0, freq_idx = 1, n_permutations = 1000)
+    assert pvalue[0, 0] == 2 / 32
+
+
+def test_monte_carlo_keeps_plus_one() -> None:
+    null = np.arange(10.0)
+    np.testing.assert_allclose(permutation_pvalue(null, np.array([9.0, 100.0]), n = 12), [2 / 11, 1 / 11])
+    pvalue = max_t_pvalue(extreme_diff(12), n_permutations = 100, seed = 0)
+    assert pvalue[0] == 1 / 101
+
+
+def test_axis_label_follows_stats_test() -> None:
+    def label(**kwargs) -> str:
+        return stats_axis_label(SpectralStatsSettings(time_axis = 'time', integration_time = 1.0, **kwargs))
+
+    assert 'Bonferroni' in label()
+    assert 'Uncorrected' in label(multiple_comparisons = False)
+    assert 'Max-t' in label(stats_test = StatsTest.PERMUTATION_MAX)
+    assert 'Cluster' in label(stats_test = StatsTest.PERMUTATION_CLUSTER)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import scipy.stats
+
+from ezmsg.ssvep.rankstats import IncrementalMannWhitneyU
+
+
+def batch_pvalue(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return scipy.stats.mannwhitneyu(x, y, alternative = 'two-sided', axis = 0).pvalue
+
+
+def test_add_matches_scipy() -> None:
+    rng = np.random.default_rng(0)
+    x = rng.normal(0.5, 1.0, size = (20, 3, 7))
+    y = rng.normal(0.0, 1.0, size = (20, 3, 7))
+
+    mwu = IncrementalMannWhitneyU()
+    for n in range(20):
+        mwu.add(x[n], y[n])
+        if n > 0:
+            np.testing.assert_allclose(mwu.pvalue(), batch_pvalue(x[:n + 1], y[:n + 1]), rtol = 1e-10)
+
+
+def test_ties_match_scipy() -> None:
+    rng = np.random.default_rng(1)
+    x = rng.integers(0, 4, size = (15, 5)).astype(float)
+    y = rng.integers(0, 4, size = (15, 5)).astype(float)
+
+    mwu = IncrementalMannWhitneyU()
+    for n in range(15):
+        mwu.add(x[n], y[n])
+    np.testing.assert_allclose(mwu.pvalue(), batch_pvalue(x, y), rtol = 1e-10)
+
+
+def test_popleft_matches_scipy() -> None:
+    rng = np.random.default_rng(2)
+    x = rng.integers(0, 6, size = (30, 4)).astype(float)
+    y = rng.integers(0, 6, size = (30, 4)).astype(float)
+
+    mwu = IncrementalMannWhitneyU(capacity = 12)
+    for n in range(30):
+        mwu.add(x[n], y[n])
+        if mwu.n > 12:
+            mwu.popleft()
+        start = max(n + 1 - 12, 0)
+        if n > 0:
+            np.testing.assert_allclose(mwu.pvalue(), batch_pvalue(x[start:n + 1], y[start:n + 1]), rtol = 1e-10)
+    np.testing.assert_array_equal(mwu.x, x[-12:])
+    np.testing.assert_array_equal(mwu.y, y[-12:])
+
+
+def test_exact_path_for_small_tie_free_samples() -> None:
+    rng = np.random.default_rng(3)
+    x = rng.normal(size = (5, 6))
+    y = rng.normal(size = (5, 6))
+
+    mwu = IncrementalMannWhitneyU()
+    for n in range(5):
+        mwu.add(x[n], y[n])
+    snapshot = mwu.snapshot()
+    assert snapshot.x is not None
+    exact = scipy.stats.mannwhitneyu(x, y, alternative = 'two-sided', method = 'exact', axis = 0).pvalue
+    np.testing.assert_allclose(snapshot.pvalue(), exact, rtol = 1e-12)
+
+
+def test_popleft_empty_raises() -> None:
+    with pytest.raises(IndexError):
+        IncrementalMannWhitneyU().popleft()
+
+
+def test_reset_accepts_new_shape() -> None:
+    rng = np.random.default_rng(4)
+    mwu = IncrementalMannWhitneyU()
+    for _ in range(3):
+        mwu.add(rng.normal(size = (4, 39)), rng.normal(size = (4, 39)))
+    mwu.reset()
+    assert mwu.n == 0
+
+    x = rng.normal(size = (5, 6, 39))
+    y = rng.normal(size = (5, 6, 39))
+    for n in range(5):
+        mwu.add(x[n], y[n])
+    np.testing.assert_allclose(mwu.pvalue(), batch_pvalue(x, y), rtol = 1e-10)
@@ -0,0 +1,80 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from ezmsg.ssvep.executor import ExecutorType, OverflowPolicy
+from ezmsg.ssvep.spectralccaextractor import (
+    SpectralCcaExtractor,
+    SpectralCcaSettings,
+    CcaDecoder,
+    TransformOutput
+)
+
+from conftest import make_unit, collect
+
+
+def window(rng: np.random.Generator, freq: float, fs: float = 250.0) -> AxisArray:
+    t = np.arange(int(fs)) / fs
+    data = rng.normal(size = (t.size, 4)) + np.sin(2 * np.pi * freq * t)[:, None]
+    return AxisArray(data, dims = ['time', 'ch'], axes = {'time': AxisArray.Axis.TimeAxis(fs, offset = 0.0)})
+
+
+def test_settings_update_rebuilds_executor_and_limits() -> None:
+    base = SpectralCcaSettings(freqoi = [7.0, 9.0, 13.0], decoder = CcaDecoder.CLOSED_FORM)
+
+    async def run() -> None:
+        unit = make_unit(SpectralCcaExtractor, base)
+        rng = np.random.default_rng(0)
+        assert unit.STATE.executor is None
+        assert len(await collect(unit.extract(window(rng, 9.0)))) == 1
+
+        await unit.on_settings(SpectralCcaSettings(
+            freqoi = base.freqoi,
+            decoder = base.decoder,
+            executor = ExecutorType.THREAD,
+            executor_workers = 1,
+            max_pending = 1,
+            overflow = OverflowPolicy.DROP_OLDEST
+        ))
+        assert unit.STATE.executor is not None
+
+        # Nothing publishes the queue here, so a second window must drop the first
+        assert await collect(unit.extract(window(rng, 9.0))) == []
+        assert await collect(unit.extract(window(rng, 9.0))) == []
+        assert len(unit.STATE.pending) == 1
+        assert unit.STATE.dropped == 1
+
+        # Back inline: the in-flight window publishes before the new one decodes
+        publisher = unit.publish_decodes()
+        queued = asyncio.ensure_future(publisher.__anext__())
+        await unit.on_settings(base)
+        assert unit.STATE.executor is None
+        stream, output = await queued
+        assert isinstance(output, TransformOutput)
+        await publisher.__anext__() # metrics
+        assert not unit.STATE.pending
+        assert len(await collect(unit.extract(window(rng, 9.0)))) == 1
+
+        await publisher.aclose()
+        unit.shutdown()
+
+    asyncio.run(run())
+
+
+
+def test_max_pending_must_be_positive() -> None:
+    bad = SpectralCcaSettings(freqoi = [7.0, 9.0], max_pending = 0, overflow = OverflowPolicy.DROP_OLDEST)
+    with pytest.raises(ValueError):
+        make_unit(SpectralCcaExtractor, bad)
+
+    async def run() -> None:
+        unit = make_unit(SpectralCcaExtractor, SpectralCcaSettings(freqoi = [7.0, 9.0], decoder = CcaDecoder.CLOSED_FORM))
+        await unit.on_settings(bad)
+        assert unit.STATE.cur_settings.max_pending == 4
+        assert len(await collect(unit.extract(window(np.random.default_rng(0), 9.0)))) == 1
+        unit.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,162 @@
+import time
+import typing
+import asyncio
+import itertools
+import threading
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.sampler import SampleMessage
+
+from ezmsg.ssvep.executor import ExecutorType
+from ezmsg.ssvep.spectralstats import SpectralStatsCalc
+
+from conftest import make_unit, drain, collect, stats_settings, trial_sample
+
+
+def make_calc(**kwargs: typing.Any) -> SpectralStatsCalc:
+    return make_unit(SpectralStatsCalc, stats_settings(**kwargs))
+
+
+def spectrum(rng: np.random.Generator, n_ch: int) -> AxisArray:
+    return AxisArray(
+        rng.normal(size = (n_ch, 125)),
+        dims = ['ch', 'freq'],
+        axes = {'freq': AxisArray.Axis(unit = 'Hz', gain = 1.0, offset = 0.0)}
+    )
+
+
+def test_layout_change_resets_and_continues() -> None:
+    rng = np.random.default_rng(0)
+    unit = make_calc()
+    for trial in range(3):
+        unit.store_spectra(spectrum(rng, 4), spectrum(rng, 4), float(trial))
+    assert unit.STATE.mwu.n == 3
+
+    for trial in range(3):
+        unit.store_spectra(spectrum(rng, 6), spectrum(rng, 6), float(trial + 3))
+    assert unit.STATE.mwu.n == 3
+    assert unit.STATE.mwu.pvalue().shape == (6, 39)
+
+
+def test_reset_then_new_montage() -> None:
+    rng = np.random.default_rng(1)
+    unit = make_calc()
+    for trial in range(3):
+        unit.store_spectra(spectrum(rng, 4), spectrum(rng, 4), float(trial))
+    unit.reset_stats()
+    for trial in range(2):
+        unit.store_spectra(spectrum(rng, 6), spectrum(rng, 6), float(trial))
+    assert unit.STATE.mwu.pvalue().shape == (6, 39)
+
+
+def make_sample(rng: np.random.Generator, trial: int) -> SampleMessage:
+    return trial_sample(rng, 100.0 + 10.0 * trial)
+
+
+async def fused_stats(unit: SpectralStatsCalc, samples: typing.List[SampleMessage]) -> typing.List[typing.Optional[AxisArray]]:
+    stats = unit.update_stats()
+    results = []
+    for sample in samples:
+        await drain(unit.split_sample(sample))
+        results.append((await stats.__anext__())[1])
+    await stats.aclose()
+    return results
+
+
+def test_executor_moves_accumulation_off_the_loop() -> None:
+    samples = [make_sample(np.random.default_rng(2), trial) for trial in range(6)]
+
+    async def run(executor: ExecutorType) -> typing.Tuple[typing.List[typing.Optional[AxisArray]], typing.Set[int]]:
+        unit = make_calc(fused_spectrum = True, executor = executor)
+        threads = set()
+        add = unit.STATE.mwu.add
+
+        def traced_add(*args: typing.Any) -> None:
+            threads.add(threading.get_ident())
+            add(*args)
+
+        unit.STATE.mwu.add = traced_add
+        try:
+            return await fused_stats(unit, samples), threads
+        finally:
+            unit.shutdown()
+
+    inline, inline_threads = asyncio.run(run(ExecutorType.NONE))
+    threaded, owner_threads = asyncio.run(run(ExecutorType.THREAD))
+
+    assert inline_threads == {threading.get_ident()}
+    assert len(owner_threads) == 1 and threading.get_ident() not in owner_threads
+    assert inline[0] is None and threaded[0] is None
+    for a, b in zip(inline[1:], threaded[1:]):
+        np.testing.assert_array_equal(a.data, b.data)
+
+
+@pytest.mark.parametrize('dims', list(itertools.permutations(['trial', 'ch', 'time'])))
+def test_stacked_trials_in_any_dim_order(dims: typing.Tuple[str, ...]) -> None:
+    samples = [make_sample(np.random.default_rng(3), trial) for trial in range(5)]
+
+    single = make_calc(fused_spectrum = True)
+    for sample in samples:
+        asyncio.run(drain(single.split_sample(sample)))
+
+    # (trial, ch, time) stacked, then transposed to the requested layout
+    data = np.stack([sample.sample.data for sample in samples])
+    order = [['trial', 'ch', 'time'].index(dim) for dim in dims]
+    stacked = SampleMessage(
+        trigger = samples[0].trigger,
+        sample = AxisArray(np.transpose(data, order), dims = list(dims), axes = samples[0].sample.axes)
+    )
+    unit = make_calc(trial_axis = 'trial')
+    assert asyncio.run(collect(unit.split_sample(stacked))) == []
+    assert unit.STATE.mwu.n == len(samples)
+
+    expected = single.STATE.mwu.pvalue()
+    freq_dims = [dim for dim in dims if dim != 'trial']
+    if freq_dims != ['ch', 'time']:
+        expected = expected.T
+    np.testing.assert_allclose(unit.STATE.mwu.pvalue(), expected)
+
+
+def test_stale_results_still_publish_under_sustained_refreshes() -> None:
+    async def run() -> int:
+        rng = np.random.default_rng(3)
+        unit = make_calc(executor = ExecutorType.THREAD, drop_stale_stats = True)
+        for trial in range(4):
+            unit.store_spectra(spectrum(rng, 4), spectrum(rng, 4), float(trial))
+
+        # Every job takes longer than the gap between refreshes
+        stats_job = unit.stats_job
+
+        def slow_stats_job() -> typing.Any:
+            version, template, job = stats_job()
+
+            def slow_job() -> typing.Any:
+                time.sleep(0.02)
+                return job()
+
+            return version, template, slow_job
+
+        unit.stats_job = slow_stats_job
+
+        async def refresh() -> None:
+            while True:
+                unit.STATE.refresh_stats.set()
+                await asyncio.sleep(0.002)
+
+        refresher = asyncio.create_task(refresh())
+        stats = unit.update_stats()
+        try:
+            published = 0
+            for _ in range(3):
+                await asyncio.wait_for(stats.__anext__(), 1.0)
+                published += 1
+            return published
+        finally:
+            refresher.cancel()
+            await stats.aclose()
+            unit.shutdown()
+
+    assert asyncio.run(run()) == 3
@@ -0,0 +1,62 @@
+import os
+import asyncio
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from ezmsg.ssvep.trca import TrcaModel, fit_trca
+from ezmsg.ssvep.trcadecoder import TrcaDecoder, TrcaDecoderSettings
+
+from conftest import make_unit, collect
+
+
+def make_model() -> TrcaModel:
+    rng = np.random.default_rng(0)
+    fs = 250.0
+    t = np.arange(250) / fs
+    labels = [7.0, 9.0, 13.0] * 4
+    epochs = rng.normal(size = (len(labels), t.size, 4))
+    for epoch, freq in zip(epochs, labels):
+        epoch += np.sin(2 * np.pi * freq * t)[:, None]
+    return fit_trca(epochs, labels, fs)
+
+
+def test_save_uses_path_as_given(tmp_path) -> None:
+    model = make_model()
+    path = str(tmp_path / 'trca_model')
+    model.save(path)
+    assert os.path.exists(path)
+    assert not os.path.exists(path + '.npz')
+
+    loaded = TrcaModel.load(path)
+    np.testing.assert_array_equal(loaded.labels, model.labels)
+    np.testing.assert_array_equal(loaded.templates, model.templates)
+    np.testing.assert_array_equal(loaded.filters, model.filters)
+    assert loaded.fs == model.fs
+
+
+def test_decoder_reloads_saved_model(tmp_path) -> None:
+    path = str(tmp_path / 'trca_model')
+    make_model().save(path)
+
+    unit = make_unit(TrcaDecoder, TrcaDecoderSettings(model_path = path))
+    assert unit.STATE.model is not None
+
+
+def window(n_time: int, n_ch: int, fs: float = 250.0) -> AxisArray:
+    data = np.random.default_rng(1).normal(size = (n_time, n_ch))
+    return AxisArray(data, dims = ['time', 'ch'], axes = {'time': AxisArray.Axis.TimeAxis(fs)})
+
+
+@pytest.mark.parametrize('msg, n_out', [
+    (window(200, 4), 1),
+    (window(200, 6), 0), # other montage
+    (window(200, 4, fs = 500.0), 0), # other sample rate
+    (window(300, 4), 0), # longer than the templates
+])
+def test_decode_skips_windows_the_model_cannot_score(msg: AxisArray, n_out: int) -> None:
+    unit = make_unit(TrcaDecoder, TrcaDecoderSettings())
+    unit.STATE.model = make_model()
+    assert len(asyncio.run(collect(unit.decode(msg)))) == n_out
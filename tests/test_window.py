@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from ezmsg.ssvep.cca import SlidingCca, cca_correlations, reference_bases
+from ezmsg.ssvep.goertzel import SlidingDft
+
+FS = 250.0
+FREQS = (7.0, 9.0, 13.0)
+N_WINDOW = 100
+N_CH = 4
+
+
+def stream(n: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(n) / FS
+    return rng.normal(size = (n, N_CH)) + np.sin(2 * np.pi * 9.0 * t)[:, None]
+
+
+# Block lengths exercise partial fills, eviction, blocks longer than the window and periodic recompute
+BLOCKS = [7, 30, 50, 13, 250, 1, 64, 99, 100, 17]
+
+
+@pytest.mark.parametrize('recompute_every', [3, 200])
+def test_sliding_dft_matches_batch(recompute_every: int) -> None:
+    data = stream(sum(BLOCKS))
+    dft = SlidingDft(FREQS, FS, N_WINDOW, N_CH, recompute_every = recompute_every)
+    omega = 2 * np.pi * np.asarray(FREQS) / FS
+    end = 0
+    for n in BLOCKS:
+        dft.update(data[end:end + n])
+        end += n
+        start = max(end - N_WINDOW, 0)
+        assert dft.n_samples == end - start
+        assert dft.full == (end >= N_WINDOW)
+        kernel = np.exp(-1j * np.outer(omega, np.arange(start, end)))
+        expected = np.abs(kernel @ data[start:end]) ** 2 / (end - start) ** 2
+        np.testing.assert_allclose(dft.power(), expected, rtol = 1e-8, atol = 1e-12)
+
+
+@pytest.mark.parametrize('recompute_every', [3, 200])
+def test_sliding_cca_matches_batch(recompute_every: int) -> None:
+    data = stream(sum(BLOCKS))
+    cca = SlidingCca(N_CH, FS, FREQS, 2, N_WINDOW, recompute_every = recompute_every)
+    end = 0
+    for n in BLOCKS:
+        cca.update(data[end:end + n])
+        end += n
+        if not cca.full:
+            continue
+        # The references are phase continuous; a time shift stays within the sin/cos span
+        expected = cca_correlations(data[end - N_WINDOW:end], reference_bases(N_WINDOW, FS, FREQS, 2))
+        np.testing.assert_allclose(cca.correlations(), expected, atol = 1e-6)
+
+
+def test_reset_empties_the_window() -> None:
+    dft = SlidingDft(FREQS, FS, N_WINDOW, N_CH)
+    data = stream(150)
+    dft.update(data[:120])
+    dft.reset()
+    assert dft.n_samples == 0
+    dft.update(data[120:])
+    kernel = np.exp(-1j * np.outer(2 * np.pi * np.asarray(FREQS) / FS, np.arange(30)))
+    np.testing.assert_allclose(dft.power(), np.abs(kernel @ data[120:]) ** 2 / 30 ** 2, rtol = 1e-8)